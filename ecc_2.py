@@ -1,5 +1,6 @@
 import hashlib
 import hmac
+import os
 import sys
 
 
@@ -47,6 +48,18 @@ Gx = 550662630222773436695787188951685343262506034537775941755001873603891167292
 Gy = 32670510020758816978083085130507043184471273380659243275938904335757337482424
 G = cast("PlainPoint2D", (Gx, Gy))
 
+# GLV endomorphism: (x, y) -> (BETA * x, y) is multiplication by LAMBDA, and
+# (A1, B1), (A2, B2) is a short basis of the lattice used to split scalars
+LAMBDA = 0x5363ad4cc05c30e0a5261c028812645a122e22ea20816678df02967c1b23bd72
+BETA = 0x7ae96a2b657c07106e64479eac3434e99cf0497512f58995c1396c28719501ee
+A1 = 0x3086d221a7d46bcde86c90e49284eb15
+B1 = -0xe4437ed6010e88286f547fa90abfe4c3
+A2 = 0x114ca50f7a8e2f3f657c1108d9d44cfd8
+B2 = A1
+
+# Default for the glv flag of jacobian_multiply and jacobian_multi_multiply
+GLV = True
+
 
 def bytes_to_int(x):
     o = 0
@@ -55,17 +68,49 @@ def bytes_to_int(x):
     return o
 
 
-# Extended Euclidean Algorithm
-def inv(a, n):
-    if a == 0:
-        return 0
-    lm, hm = 1, 0
-    low, high = a % n, n
-    while low > 1:
-        r = high // low
-        nm, new = hm - lm * r, high - low * r
-        lm, low, hm, high = nm, new, lm, low
-    return lm % n
+# Field arithmetic backend, picked once at import: gmpy2 mpz when it is
+# installed, Python ints otherwise. ECC_2_BACKEND=python forces the fallback.
+BACKEND = os.environ.get("ECC_2_BACKEND", "gmpy2")
+if BACKEND == "gmpy2":
+    try:
+        import gmpy2
+    except ImportError:
+        BACKEND = "python"
+
+if BACKEND == "gmpy2":
+    mpz = gmpy2.mpz
+
+    def inv(a, n):
+        if not a % n:
+            return 0
+        return int(gmpy2.invert(a, n))
+elif sys.version_info >= (3, 8):
+    mpz = int
+
+    def inv(a, n):
+        if not a % n:
+            return 0
+        return pow(a, -1, n)
+else:
+    mpz = int
+
+    # Extended Euclidean Algorithm
+    def inv(a, n):
+        if a == 0:
+            return 0
+        lm, hm = 1, 0
+        low, high = a % n, n
+        while low > 1:
+            r = high // low
+            nm, new = hm - lm * r, high - low * r
+            lm, low, hm, high = nm, new, lm, low
+        return lm % n
+
+
+# Field modulus in the backend's integer type; reducing by it keeps every
+# intermediate coordinate in that type. Points handed back to callers are
+# converted to plain ints.
+_P = mpz(P)
 
 
 def to_jacobian(p):
@@ -73,15 +118,18 @@ def to_jacobian(p):
     return cast("PlainPoint3D", o)
 
 
+# dbl-2009-l, which relies on A = 0
 def jacobian_double(p):
     if not p[1]:
         return cast("PlainPoint3D", (0, 0, 0))
-    ysq = (p[1] ** 2) % P
-    S = (4 * p[0] * ysq) % P
-    M = (3 * p[0] ** 2 + A * p[2] ** 4) % P
-    nx = (M**2 - 2 * S) % P
-    ny = (M * (S - nx) - 8 * ysq ** 2) % P
-    nz = (2 * p[1] * p[2]) % P
+    XX = (p[0] * p[0]) % _P
+    YY = (p[1] * p[1]) % _P
+    YYYY = (YY * YY) % _P
+    D = (2 * ((p[0] + YY) ** 2 - XX - YYYY)) % _P
+    E = 3 * XX
+    nx = (E * E - 2 * D) % _P
+    ny = (E * (D - nx) - 8 * YYYY) % _P
+    nz = (2 * p[1] * p[2]) % _P
     return cast("PlainPoint3D", (nx, ny, nz))
 
 
@@ -90,41 +138,233 @@ def jacobian_add(p, q):
         return q
     if not q[1]:
         return p
-    U1 = (p[0] * q[2] ** 2) % P
-    U2 = (q[0] * p[2] ** 2) % P
-    S1 = (p[1] * q[2] ** 3) % P
-    S2 = (q[1] * p[2] ** 3) % P
+    U1 = (p[0] * q[2] ** 2) % _P
+    U2 = (q[0] * p[2] ** 2) % _P
+    S1 = (p[1] * q[2] ** 3) % _P
+    S2 = (q[1] * p[2] ** 3) % _P
     if U1 == U2:
         if S1 != S2:
             return cast("PlainPoint3D", (0, 0, 1))
         return jacobian_double(p)
     H = U2 - U1
     R = S2 - S1
-    H2 = (H * H) % P
-    H3 = (H * H2) % P
-    U1H2 = (U1 * H2) % P
-    nx = (R ** 2 - H3 - 2 * U1H2) % P
-    ny = (R * (U1H2 - nx) - S1 * H3) % P
-    nz = (H * p[2] * q[2]) % P
+    H2 = (H * H) % _P
+    H3 = (H * H2) % _P
+    U1H2 = (U1 * H2) % _P
+    nx = (R ** 2 - H3 - 2 * U1H2) % _P
+    ny = (R * (U1H2 - nx) - S1 * H3) % _P
+    nz = (H * p[2] * q[2]) % _P
     return cast("PlainPoint3D", (nx, ny, nz))
 
 
-def from_jacobian(p):
-    z = inv(p[2], P)
-    return cast("PlainPoint2D", ((p[0] * z**2) % P, (p[1] * z**3) % P))
+# madd-2007-bl: p + q where q has Z = 1, as every precomputed table entry does
+def jacobian_add_mixed(p, q):
+    if not p[1]:
+        return q
+    Z1Z1 = (p[2] * p[2]) % _P
+    H = (q[0] * Z1Z1 - p[0]) % _P
+    R = (2 * (q[1] * p[2] * Z1Z1 - p[1])) % _P
+    if not H:
+        if R:
+            return cast("PlainPoint3D", (0, 0, 1))
+        return jacobian_double(q)
+    HH = (H * H) % _P
+    HH4 = 4 * HH
+    J = (H * HH4) % _P
+    V = (p[0] * HH4) % _P
+    nx = (R * R - J - 2 * V) % _P
+    ny = (R * (V - nx) - 2 * p[1] * J) % _P
+    nz = (2 * p[2] * H) % _P
+    return cast("PlainPoint3D", (nx, ny, nz))
 
 
-def jacobian_multiply(a, n):   # type: ignore
+def from_jacobian(p):
+    z = inv(p[2], _P)
+    return cast("PlainPoint2D", (
+        int((p[0] * z**2) % _P), int((p[1] * z**3) % _P)))
+
+
+# Montgomery's trick: invert every value with a single inv() call. Zeros map
+# to 0, as with inv().
+def batch_inv(values, n):
+    prefix = []
+    acc = 1
+    for v in values:
+        prefix.append(acc)
+        if v:
+            acc = (acc * v) % n
+    acc = inv(acc, n)
+    result = [0] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        if values[i]:
+            result[i] = (prefix[i] * acc) % n
+            acc = (acc * values[i]) % n
+    return result
+
+
+# Rescales points to Z = 1 with one shared inversion, keeping the backend's
+# integer type so the result can feed jacobian_add_mixed directly
+def batch_normalize(points):
+    result = []
+    for p, z in zip(points, batch_inv([p[2] for p in points], _P)):
+        z2 = (z * z) % _P
+        result.append(cast("PlainPoint3D", (
+            (p[0] * z2) % _P, (p[1] * z2 * z) % _P, 1)))
+    return result
+
+
+def batch_from_jacobian(points):
+    return [cast("PlainPoint2D", (int(p[0]), int(p[1])))
+            for p in batch_normalize(points)]
+
+
+def jacobian_negate(p):
+    return cast("PlainPoint3D", (p[0], (P - p[1]) % _P, p[2]))
+
+
+# Width-w non-adjacent form, least significant digit first. Every non-zero
+# digit is odd and below 2**(w-1) in magnitude, and is followed by at least
+# w - 1 zeros.
+WNAF_WIDTH = 5
+
+
+def wnaf(n, w=WNAF_WIDTH):
+    digits = []
+    full = 1 << w
+    half = full >> 1
+    while n:
+        d = 0
+        if n & 1:
+            d = n & (full - 1)
+            if d >= half:
+                d -= full
+            n -= d
+        digits.append(d)
+        n >>= 1
+    return digits
+
+
+# a, 3a, 5a, ..., (2**(w-1) - 1)a, normalized to Z = 1
+def _jacobian_odd_multiples(a, w):
+    a2 = jacobian_double(a)
+    table = [a]
+    for _ in range((1 << (w - 2)) - 1):
+        table.append(jacobian_add(table[-1], a2))
+    return table
+
+
+def odd_multiples(a, w=WNAF_WIDTH):
+    return batch_normalize(_jacobian_odd_multiples(a, w))
+
+
+# Normalizes several odd-multiple tables with a single shared inversion
+def _normalize_tables(tables):
+    if not tables:
+        return []
+    flat = batch_normalize([p for table in tables for p in table])
+    result = []
+    for table in tables:
+        result.append(flat[:len(table)])
+        flat = flat[len(table):]
+    return result
+
+
+def jacobian_multiply(a, n, glv=None):
+    if glv is None:
+        glv = GLV
+    if glv:
+        return jacobian_multi_multiply([(a, n)], glv=True)
+    n %= N
     if a[1] == 0 or n == 0:
         return cast("PlainPoint3D", (0, 0, 1))
-    if n == 1:
-        return a
-    if n < 0 or n >= N:
-        return jacobian_multiply(a, n % N)
-    if (n % 2) == 0:
-        return jacobian_double(jacobian_multiply(a, n // 2))
-    if (n % 2) == 1:
-        return jacobian_add(jacobian_double(jacobian_multiply(a, n // 2)), a)
+    table = odd_multiples(a)
+    negated = [jacobian_negate(p) for p in table]
+    result = cast("PlainPoint3D", (0, 0, 1))
+    for d in reversed(wnaf(n)):
+        result = jacobian_double(result)
+        if d > 0:
+            result = jacobian_add_mixed(result, table[d >> 1])
+        elif d < 0:
+            result = jacobian_add_mixed(result, negated[-d >> 1])
+    return result
+
+
+def jacobian_endomorphism(p):
+    return cast("PlainPoint3D", ((BETA * p[0]) % _P, p[1], p[2]))
+
+
+# n = k1 + k2 * LAMBDA (mod N) with |k1|, |k2| around 2**128
+def glv_split(n):
+    c1 = (B2 * n + N // 2) // N
+    c2 = (-B1 * n + N // 2) // N
+    return n - c1 * A1 - c2 * A2, -c1 * B1 - c2 * B2
+
+
+# Odd multiples of G for the interleaved wNAF below, built once at a wider
+# window than a variable base can afford
+G_WNAF_WIDTH = 7
+_G_ODD_MULTIPLES = None
+
+
+def _wnaf_term(table, n, w):
+    negated = [jacobian_negate(p) for p in table]
+    if n < 0:
+        return (wnaf(-n, w), negated, table)
+    return (wnaf(n, w), table, negated)
+
+
+def _scalar_terms(table, n, w, glv):
+    if not glv:
+        return [_wnaf_term(table, n, w)]
+    k1, k2 = glv_split(n)
+    terms = []
+    if k1:
+        terms.append(_wnaf_term(table, k1, w))
+    if k2:
+        terms.append(_wnaf_term(
+            [jacobian_endomorphism(p) for p in table], k2, w))
+    return terms
+
+
+# Strauss-Shamir: g * G + sum(n * a for a, n in pairs) sharing one chain of
+# doublings across every term. With glv, each scalar is split into two
+# half-length ones, halving the doublings.
+def jacobian_multi_multiply(pairs, g=0, glv=None):
+    pairs = [(a, n % N) for a, n in pairs if a[1] and n % N]
+    tables = _normalize_tables(
+        [_jacobian_odd_multiples(a, WNAF_WIDTH) for a, _ in pairs])
+    return _multi_multiply_tables(
+        [(table, n) for table, (_, n) in zip(tables, pairs)], g, glv)
+
+
+# jacobian_multi_multiply with the odd-multiple tables of the variable
+# bases already normalized, as (table, n) pairs
+def _multi_multiply_tables(pairs, g=0, glv=None):
+    global _G_ODD_MULTIPLES
+    if glv is None:
+        glv = GLV
+    terms = []
+    g %= N
+    if g:
+        if _G_ODD_MULTIPLES is None:
+            _G_ODD_MULTIPLES = odd_multiples(to_jacobian(G), G_WNAF_WIDTH)
+        terms.extend(_scalar_terms(_G_ODD_MULTIPLES, g, G_WNAF_WIDTH, glv))
+    for table, n in pairs:
+        terms.extend(_scalar_terms(table, n, WNAF_WIDTH, glv))
+    result = cast("PlainPoint3D", (0, 0, 1))
+    if not terms:
+        return result
+    for i in range(max(len(t[0]) for t in terms) - 1, -1, -1):
+        result = jacobian_double(result)
+        for digits, table, negated in terms:
+            if i >= len(digits):
+                continue
+            d = digits[i]
+            if d > 0:
+                result = jacobian_add_mixed(result, table[d >> 1])
+            elif d < 0:
+                result = jacobian_add_mixed(result, negated[-d >> 1])
+    return result
 
 
 def multiply(a, n):
@@ -135,9 +375,44 @@ def add(a, b):
     return from_jacobian(jacobian_add(to_jacobian(a), to_jacobian(b)))
 
 
+# Fixed-base comb for G: row i holds d * 2**(_G_WINDOW * i) * G for
+# d = 1 .. 2**_G_WINDOW - 1, so a G-multiply is one addition per window
+_G_WINDOW = 4
+_G_TABLE = None
+
+
+def _build_g_table():
+    table = []
+    base = cast("PlainPoint3D", (Gx, Gy, 1))
+    for _ in range((256 + _G_WINDOW - 1) // _G_WINDOW):
+        row = [base]
+        for _ in range((1 << _G_WINDOW) - 2):
+            row.append(jacobian_add(row[-1], base))
+        base = jacobian_add(row[-1], base)
+        table.append(batch_normalize(row))
+    return table
+
+
+def fixed_base_multiply(n):
+    global _G_TABLE
+    if _G_TABLE is None:
+        _G_TABLE = _build_g_table()
+    n %= N
+    mask = (1 << _G_WINDOW) - 1
+    result = cast("PlainPoint3D", (0, 0, 1))
+    for row in _G_TABLE:
+        if not n:
+            break
+        d = n & mask
+        if d:
+            result = jacobian_add_mixed(result, row[d - 1])
+        n >>= _G_WINDOW
+    return result
+
+
 # bytes32
 def privtopub(privkey):
-    return multiply(G, bytes_to_int(privkey))
+    return from_jacobian(fixed_base_multiply(bytes_to_int(privkey)))
 
 
 def deterministic_generate_k(msghash, priv):
@@ -150,24 +425,70 @@ def deterministic_generate_k(msghash, priv):
     return bytes_to_int(hmac.new(k, v, hashlib.sha256).digest())
 
 
-def ecdsa_raw_recover(msghash, vrs):
+# Low-s signature with v in 27/28, using the deterministic k above
+def ecdsa_raw_sign(msghash, priv):
+    z = bytes_to_int(msghash)
+    k = deterministic_generate_k(msghash, priv)
+    r, y = from_jacobian(fixed_base_multiply(k))
+    s = inv(k, N) * (z + r * bytes_to_int(priv)) % N
+    v = 27 + ((y % 2) ^ (0 if s * 2 < N else 1))
+    if s * 2 >= N:
+        s = N - s
+    return v, r, s
+
+
+# R = (r, y) with the parity of y picked by v
+def _recover_r_point(vrs):
     v, r, s = vrs
     if not (27 <= v <= 34):
         raise ValueError("%d must in range 27-31" % v)
     x = r
-    xcubedaxb = (x * x * x + A * x + B) % P
-    beta = pow(xcubedaxb, (P + 1) // 4, P)
+    xcubedaxb = (x * x * x + A * x + B) % _P
+    beta = pow(xcubedaxb, (P + 1) // 4, _P)
     y = beta if v % 2 ^ beta % 2 else (P - beta)
     # If xcubedaxb is not a quadratic residue, then r cannot be the x coord
     # for a point on the curve, and so the sig is invalid
-    if (xcubedaxb - y * y) % P != 0 or not (r % N) or not (s % N):
+    if (xcubedaxb - y * y) % _P != 0 or not (r % N) or not (s % N):
         raise ValueError(
             "sig is invalid, %d cannot be the x coord for point on curve" % r)
+    return cast("PlainPoint3D", (x, y, 1))
+
+
+def ecdsa_raw_recover(msghash, vrs):
+    v, r, s = vrs
+    R = _recover_r_point(vrs)
     z = bytes_to_int(msghash)
-    Gz = jacobian_multiply(cast("PlainPoint3D", (Gx, Gy, 1)), (N - z) % N)
-    XY = jacobian_multiply(cast("PlainPoint3D", (x, y, 1)), s)
-    Qr = jacobian_add(Gz, XY)
-    Q = jacobian_multiply(Qr, inv(r, N))
+    # Q = r^-1 (sR - zG) = u1 G + u2 R
+    rinv = inv(r, N)
+    u1 = (-z * rinv) % N
+    u2 = (s * rinv) % N
+    Q = jacobian_multi_multiply([(R, u2)], u1)
     Q_jacobian = from_jacobian(Q)
 
     return Q_jacobian
+
+
+# Recovers a list of (msghash, vrs) pairs with three inversions for the
+# whole batch: one mod N for the r^-1 scalars, one mod P for every R table
+# and one mod P for the affine conversion. Returns
+# (pubkey, None) or (None, error) per item instead of raising.
+def ecdsa_raw_recover_batch(items):
+    results = [None] * len(items)
+    pending = []
+    for i, (msghash, vrs) in enumerate(items):
+        try:
+            pending.append((i, bytes_to_int(msghash), vrs,
+                            _recover_r_point(vrs)))
+        except (TypeError, ValueError) as e:
+            results[i] = (None, e)
+    rinvs = batch_inv([vrs[1] for _, _, vrs, _ in pending], N)
+    tables = _normalize_tables(
+        [_jacobian_odd_multiples(R, WNAF_WIDTH) for _, _, _, R in pending])
+    points = []
+    for (_, z, vrs, _), rinv, table in zip(pending, rinvs, tables):
+        u1 = (-z * rinv) % N
+        u2 = (vrs[2] * rinv) % N
+        points.append(_multi_multiply_tables([(table, u2)], u1))
+    for (i, _, _, _), Q in zip(pending, batch_from_jacobian(points)):
+        results[i] = (Q, None)
+    return results
@@ -2,8 +2,360 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
 
+import logging
+import math
+import random
+import time
+
 import dbus
 
+try:
+    from gi.repository import GLib
+except ImportError:
+    import gobject as GLib
+
+BLUEZ_SERVICE_NAME = "org.bluez"
+DBUS_OM_IFACE = "org.freedesktop.DBus.ObjectManager"
+DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
+ADAPTER_IFACE = "org.bluez.Adapter1"
+DEVICE_IFACE = "org.bluez.Device1"
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRegistry(object):
+    """
+    Cache of the bluez adapters and devices
+
+    start() loads the object tree once; after that InterfacesAdded,
+    InterfacesRemoved and PropertiesChanged keep it current, so lookups
+    by path, adapter or address and the list of trusted/paired devices
+    need no bus round-trips. Listeners are called as
+    listener(path, properties, changed) after a device is added
+    (changed holds all its properties), changes, or is removed
+    (properties is None).
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.adapters = {}
+        self.devices = {}
+        self.trusted = set()
+        self._by_adapter = {}
+        self._by_address = {}
+        self._listeners = []
+        self._receivers = []
+
+    def start(self):
+        if self._receivers:
+            return
+        # subscribe first so nothing that changes during the load is lost
+        self._receivers = [
+            self.bus.add_signal_receiver(
+                self._interfaces_added, dbus_interface=DBUS_OM_IFACE,
+                signal_name="InterfacesAdded", bus_name=BLUEZ_SERVICE_NAME),
+            self.bus.add_signal_receiver(
+                self._interfaces_removed, dbus_interface=DBUS_OM_IFACE,
+                signal_name="InterfacesRemoved", bus_name=BLUEZ_SERVICE_NAME),
+            self.bus.add_signal_receiver(
+                self._properties_changed, dbus_interface=DBUS_PROP_IFACE,
+                signal_name="PropertiesChanged", arg0=DEVICE_IFACE,
+                bus_name=BLUEZ_SERVICE_NAME, path_keyword="path"),
+        ]
+        self.load()
+
+    def stop(self):
+        for receiver in self._receivers:
+            receiver.remove()
+        self._receivers = []
+
+    def load(self):
+        manager = dbus.Interface(self.bus.get_object(BLUEZ_SERVICE_NAME, "/"),
+                                 DBUS_OM_IFACE)
+        for path, interfaces in manager.GetManagedObjects().items():
+            self._interfaces_added(path, interfaces)
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def get(self, path):
+        """
+        Returns the Device1 properties of a device, or None
+        """
+        return self.devices.get(str(path))
+
+    def find(self, address, adapter=None):
+        """
+        Returns the path of the device with address, on adapter if given
+        """
+        paths = self._by_address.get(str(address).upper(), {})
+        if adapter is not None:
+            return paths.get(str(adapter))
+        for path in paths.values():
+            return path
+        return None
+
+    def devices_on(self, adapter):
+        return list(self._by_adapter.get(str(adapter), ()))
+
+    def trusted_devices(self, adapter=None):
+        """
+        Returns the paths of trusted or paired devices
+        """
+        if adapter is None:
+            return list(self.trusted)
+        return [path for path in self._by_adapter.get(str(adapter), ())
+                if path in self.trusted]
+
+    def _notify(self, path, properties, changed):
+        for listener in list(self._listeners):
+            try:
+                listener(path, properties, changed)
+            except Exception:
+                logger.exception("Device listener failed for %s" % path)
+
+    def _index(self, path, properties):
+        if properties.get("Trusted") or properties.get("Paired"):
+            self.trusted.add(path)
+        else:
+            self.trusted.discard(path)
+
+    def _interfaces_added(self, path, interfaces):
+        path = str(path)
+        if ADAPTER_IFACE in interfaces:
+            self.adapters[path] = dict(interfaces[ADAPTER_IFACE])
+            self._by_adapter.setdefault(path, set())
+        if DEVICE_IFACE not in interfaces:
+            return
+        properties = dict(interfaces[DEVICE_IFACE])
+        adapter = str(properties.get("Adapter", path.rsplit("/", 1)[0]))
+        address = str(properties.get("Address", "")).upper()
+        self.devices[path] = properties
+        self._by_adapter.setdefault(adapter, set()).add(path)
+        self._by_address.setdefault(address, {})[adapter] = path
+        self._index(path, properties)
+        self._notify(path, properties, properties)
+
+    def _interfaces_removed(self, path, interfaces):
+        path = str(path)
+        if ADAPTER_IFACE in interfaces:
+            self.adapters.pop(path, None)
+            self._by_adapter.pop(path, None)
+        if DEVICE_IFACE not in interfaces:
+            return
+        properties = self.devices.pop(path, None)
+        if properties is None:
+            return
+        adapter = str(properties.get("Adapter", path.rsplit("/", 1)[0]))
+        address = str(properties.get("Address", "")).upper()
+        self._by_adapter.get(adapter, set()).discard(path)
+        paths = self._by_address.get(address, {})
+        if paths.get(adapter) == path:
+            del paths[adapter]
+            if not paths:
+                del self._by_address[address]
+        self.trusted.discard(path)
+        self._notify(path, None, {})
+
+    def _properties_changed(self, interface, changed, invalidated, path=None):
+        properties = self.devices.get(str(path))
+        if properties is None:
+            return
+        properties.update(changed)
+        for name in invalidated:
+            properties.pop(name, None)
+        self._index(str(path), properties)
+        self._notify(str(path), properties, changed)
+
+
+class ReconnectScheduler(object):
+    """
+    Reconnects trusted devices from a DeviceRegistry in the background
+
+    Device1.Connect is called asynchronously for up to max_in_flight
+    devices at a time, so an unreachable phone only holds one slot until
+    bluez gives up. A device that fails is retried after an exponential
+    backoff (initial_backoff doubling up to max_backoff, with jitter).
+    Devices seen recently (RSSI or advertising data changed) go first and
+    skip their remaining backoff. A device that disconnects waits at least
+    initial_backoff before it is reconnected, and longer each time unless
+    its link stayed up for min_uptime seconds; hold() keeps a device away
+    for longer, e.g. because the daemon disconnected it on purpose.
+    """
+
+    SEEN_PROPERTIES = ("RSSI", "ManufacturerData", "ServiceData")
+
+    def __init__(self, bus, registry, max_in_flight=4, initial_backoff=2.0,
+                 max_backoff=300.0, connect_timeout=30.0, min_uptime=10.0):
+        self.bus = bus
+        self.registry = registry
+        self.max_in_flight = max_in_flight
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.min_uptime = min_uptime
+        self.in_flight = set()
+        # path -> (failed attempts, monotonic time of the next attempt)
+        self._backoff = {}
+        # path -> monotonic time the device was last seen connecting
+        self._connected_at = {}
+        # path -> monotonic time before which the device is left alone
+        self._held = {}
+        self._last_seen = {}
+        self._timer = None
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        for path in self.registry.trusted_devices():
+            properties = self.registry.get(path)
+            if properties is not None and properties.get("Connected"):
+                # connected for an unknown time, so counted as stable
+                self._connected_at[path] = 0
+        self.registry.add_listener(self._device_changed)
+        self._schedule(0)
+
+    def stop(self):
+        if not self._started:
+            return
+        self._started = False
+        self.registry.remove_listener(self._device_changed)
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+
+    def candidates(self, now=None):
+        """
+        Returns the trusted, disconnected devices that are due, most
+        recently seen first
+        """
+        now = time.monotonic() if now is None else now
+        due = []
+        for path, next_attempt in self._waiting():
+            if next_attempt <= now:
+                attempts = self._backoff.get(path, (0, 0))[0]
+                due.append((-self._last_seen.get(path, 0), attempts, path))
+        return [path for _, _, path in sorted(due)]
+
+    def hold(self, path, delay):
+        """
+        Keeps path from being reconnected for the next delay seconds, or
+        longer if an earlier hold ends later. Unlike the backoff after a
+        failed attempt, seeing the device does not cut this short.
+        """
+        path = str(path)
+        self._held[path] = max(self._held.get(path, 0),
+                               time.monotonic() + delay)
+
+    def _waiting(self):
+        """
+        Yields (path, monotonic time of the next attempt) for every
+        trusted device that is neither connected nor being connected
+        """
+        for path in self.registry.trusted_devices():
+            properties = self.registry.get(path)
+            if properties is None or properties.get("Connected") or \
+                    path in self.in_flight:
+                continue
+            yield path, max(self._backoff.get(path, (0, 0))[1],
+                            self._held.get(path, 0))
+
+    def _schedule(self, delay):
+        if not self._started:
+            return
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+        # rounded up so the timer never fires just before a device is due
+        self._timer = GLib.timeout_add(int(math.ceil(delay * 1000)), self._run)
+
+    def _run(self):
+        self._timer = None
+        now = time.monotonic()
+        for path in self.candidates(now):
+            if len(self.in_flight) >= self.max_in_flight:
+                break
+            self._connect(path)
+
+        # _connected and _failed reschedule once a slot frees up
+        if len(self.in_flight) >= self.max_in_flight:
+            return False
+        pending = [next_attempt for _, next_attempt in self._waiting()
+                   if next_attempt > now]
+        if pending:
+            self._schedule(min(pending) - now)
+        return False
+
+    def _connect(self, path):
+        logger.info("Connecting to %s" % path)
+        self.in_flight.add(path)
+        device = dbus.Interface(self.bus.get_object(BLUEZ_SERVICE_NAME, path),
+                                DEVICE_IFACE)
+        device.Connect(reply_handler=lambda: self._connected(path),
+                       error_handler=lambda e: self._failed(path, e),
+                       timeout=self.connect_timeout)
+
+    def _connected(self, path):
+        logger.info("Connected to %s" % path)
+        self.in_flight.discard(path)
+        # the attempt count is kept until the link proves stable
+        self._connected_at.setdefault(path, time.monotonic())
+        self._schedule(0)
+
+    def _disconnected(self, path):
+        now = time.monotonic()
+        attempts = self._backoff.get(path, (0, 0))[0]
+        if now - self._connected_at.pop(path) >= self.min_uptime:
+            attempts = 0
+        # one step further than a failed connect, so never below
+        # initial_backoff even with jitter
+        delay = self._backoff_delay(attempts + 2)
+        logger.info("%s disconnected, reconnecting in %.1fs" % (path, delay))
+        self._backoff[path] = (attempts + 1, now + delay)
+        self.hold(path, delay)
+
+    def _backoff_delay(self, attempts):
+        delay = min(self.max_backoff,
+                    self.initial_backoff * 2 ** (attempts - 1))
+        # equal jitter: somewhere in the upper half of the backoff
+        return random.uniform(delay / 2, delay)
+
+    def _failed(self, path, error):
+        if isinstance(error, dbus.exceptions.DBusException) and \
+                error.get_dbus_name() == "org.bluez.Error.AlreadyConnected":
+            self._connected(path)
+            return
+        self.in_flight.discard(path)
+        attempts = self._backoff.get(path, (0, 0))[0] + 1
+        delay = self._backoff_delay(attempts)
+        logger.info("Connecting to %s failed (%s), retrying in %.1fs" %
+                    (path, error, delay))
+        self._backoff[path] = (attempts, time.monotonic() + delay)
+        self._schedule(0)
+
+    def _device_changed(self, path, properties, changed):
+        if properties is None or path not in self.registry.trusted:
+            self._backoff.pop(path, None)
+            self._held.pop(path, None)
+            self._connected_at.pop(path, None)
+            self._last_seen.pop(path, None)
+            return
+        if properties.get("Connected"):
+            self._connected_at.setdefault(path, time.monotonic())
+        elif path in self._connected_at:
+            self._disconnected(path)
+        seen = any(name in changed for name in self.SEEN_PROPERTIES)
+        if seen:
+            self._last_seen[path] = time.monotonic()
+            if path in self._backoff:
+                self._backoff[path] = (self._backoff[path][0], 0)
+        if seen or "Connected" in changed:
+            self._schedule(0)
+
 
 def listDevices(logger):
     paths = []
@@ -34,15 +386,15 @@ def listDevices(logger):
 
     objects = manager.GetManagedObjects()
 
-    all_devices = (str(path) for path, interfaces in objects.items() if
-                   "org.bluez.Device1" in interfaces.keys())
+    # a list, a generator would be used up by the first adapter
+    all_devices = [str(path) for path, interfaces in objects.items() if
+                   "org.bluez.Device1" in interfaces.keys()]
 
     for path, interfaces in objects.items():
         if "org.bluez.Adapter1" not in interfaces.keys():
             continue
 
         logger.info("[ " + path + " ]")
-        logger.info(path)
         paths.append(path.strip())
 
         properties = interfaces["org.bluez.Adapter1"]
@@ -50,9 +402,9 @@ def listDevices(logger):
             value = properties[key]
             if (key == "UUIDs"):
                 list = extract_uuids(value)
-                logger.info("    %s = %s" % (key, list))
+                logger.debug("    %s = %s" % (key, list))
             else:
-                logger.info("    %s = %s" % (key, value))
+                logger.debug("    %s = %s" % (key, value))
 
         device_list = [d for d in all_devices if d.startswith(path + "/")]
 
@@ -66,17 +418,17 @@ def listDevices(logger):
                 value = properties[key]
                 if (key == "UUIDs"):
                     list = extract_uuids(value)
-                    logger.info("        %s = %s" % (key, list))
+                    logger.debug("        %s = %s" % (key, list))
                 elif (key == "Class"):
-                    logger.info("        %s = 0x%06x" % (key, value))
+                    logger.debug("        %s = 0x%06x" % (key, value))
                 elif (key == "Vendor"):
-                    logger.info("        %s = 0x%04x" % (key, value))
+                    logger.debug("        %s = 0x%04x" % (key, value))
                 elif (key == "Product"):
-                    logger.info("        %s = 0x%04x" % (key, value))
+                    logger.debug("        %s = 0x%04x" % (key, value))
                 elif (key == "Version"):
-                    logger.info("        %s = 0x%04x" % (key, value))
+                    logger.debug("        %s = 0x%04x" % (key, value))
                 else:
-                    logger.info("        %s = %s" % (key, value))
+                    logger.debug("        %s = %s" % (key, value))
 
         logger.info("")
     return paths
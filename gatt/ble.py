@@ -1,10 +1,21 @@
 
+import collections
+import concurrent.futures
 import dbus
 import dbus.exceptions
 import dbus.mainloop.glib
 import dbus.service
 import logging
+import socket
 import sys
+import time
+
+try:
+    from gi.repository import GLib
+except ImportError:
+    import gobject as GLib
+
+from gatt.stats import timed
 
 
 class InvalidArgsException(dbus.exceptions.DBusException):
@@ -15,6 +26,18 @@ class NotSupportedException(dbus.exceptions.DBusException):
     _dbus_error_name = "org.bluez.Error.NotSupported"
 
 
+class InvalidOffsetException(dbus.exceptions.DBusException):
+    _dbus_error_name = "org.bluez.Error.InvalidOffset"
+
+
+class InvalidValueLengthException(dbus.exceptions.DBusException):
+    _dbus_error_name = "org.bluez.Error.InvalidValueLength"
+
+
+class NotPermittedException(dbus.exceptions.DBusException):
+    _dbus_error_name = "org.bluez.Error.NotPermitted"
+
+
 DBUS_OM_IFACE = "org.freedesktop.DBus.ObjectManager"
 DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
 
@@ -29,14 +52,44 @@ BLUEZ_SERVICE_NAME = "org.bluez"
 GATT_MANAGER_IFACE = "org.bluez.GattManager1"
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-logHandler = logging.StreamHandler()
-formatter = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-logHandler.setFormatter(formatter)
-logger.addHandler(logHandler)
 
-logger.setLevel(logging.DEBUG)
+# Packets read from an AcquireWrite socket per mainloop wakeup
+ACQUIRED_WRITE_BATCH = 64
+
+# Characteristics with offload set run their handlers on this pool, so
+# signing and subprocess calls do not block the GLib mainloop
+WORKER_THREADS = 4
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=WORKER_THREADS)
+    return _executor
+
+
+def set_executor(executor):
+    """
+    Replaces the worker pool, e.g. with a ProcessPoolExecutor. Handlers
+    submitted to a process pool must be picklable.
+    """
+    global _executor
+    _executor = executor
+
+
+def value_bytes(value):
+    """
+    Returns a characteristic or descriptor value as bytes. bytes and
+    dbus.ByteArray (a bytes subclass, which is what byte_arrays=True
+    methods receive) pass through without a copy.
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return bytes(value)
 
 
 def find_adapter(bus):
@@ -54,14 +107,38 @@ def find_adapter(bus):
     return None
 
 
+def _remove_from_connection(obj):
+    try:
+        obj.remove_from_connection()
+    except LookupError:
+        pass
+
+
 class Application(dbus.service.Object):
     """
     org.bluez.GattApplication1 interface implementation
+
+    Services, characteristics and descriptors can be added and removed
+    while the application is registered; each change is announced with
+    ObjectManager InterfacesAdded/InterfacesRemoved instead of
+    re-registering the whole application.
+
+    Every object in the tree is indexed by object path and by UUID, so
+    get_object() and find_by_uuid() are dict lookups.
+
+    bluez only reads the tree at RegisterApplication, so objects added
+    afterwards are not seen by centrals until the application is
+    registered again. Characteristics that come and go at runtime belong
+    in an application of their own, at its own path, that is registered
+    and unregistered as a whole.
     """
 
-    def __init__(self, bus):
-        self.path = "/"
+    def __init__(self, bus, path="/"):
+        self.path = path
         self.services = []
+        self.objects = {}
+        self.objects_by_uuid = {}
+        self._managed_objects = None
         dbus.service.Object.__init__(self, bus, self.path)
 
     def get_path(self):
@@ -69,64 +146,167 @@ class Application(dbus.service.Object):
 
     def add_service(self, service):
         self.services.append(service)
+        service.application = self
+        self.objects_added(service)
+
+    def remove_service(self, service):
+        self.services.remove(service)
+        for characteristic in service.get_characteristics():
+            characteristic.release()
+        self.objects_removed(service)
+        service.application = None
+
+    def release(self):
+        """
+        Removes every service and takes the application off the bus
+        """
+        for service in list(self.services):
+            self.remove_service(service)
+        _remove_from_connection(self)
+
+    def get_object(self, path):
+        return self.objects.get(path)
+
+    def find_by_uuid(self, uuid):
+        """
+        Returns every object with this UUID; descriptor UUIDs such as the
+        CUD are shared between characteristics
+        """
+        return self.objects_by_uuid.get(str(uuid).lower(), [])
+
+    def objects_added(self, obj):
+        self.invalidate()
+        for child in obj.walk():
+            self.objects[child.get_path()] = child
+            self.objects_by_uuid.setdefault(
+                str(child.uuid).lower(), []).append(child)
+            self.InterfacesAdded(child.get_path(), child.get_properties())
+
+    def objects_removed(self, obj):
+        self.invalidate()
+        for child in reversed(obj.walk()):
+            self.objects.pop(child.get_path(), None)
+            same_uuid = self.objects_by_uuid.get(str(child.uuid).lower(), [])
+            if child in same_uuid:
+                same_uuid.remove(child)
+            self.InterfacesRemoved(
+                child.get_path(), dbus.Array(child.get_properties().keys(),
+                                             signature="s"))
+            _remove_from_connection(child)
+
+    def invalidate(self):
+        """
+        Drops the cached GetManagedObjects response after the tree changed
+        """
+        self._managed_objects = None
 
     @dbus.service.method(DBUS_OM_IFACE, out_signature="a{oa{sa{sv}}}")
+    @timed
     def GetManagedObjects(self):
-        response = {}
-        logger.info("GetManagedObjects")
+        logger.debug("GetManagedObjects")
+        if self._managed_objects is None:
+            self._managed_objects = self.build_managed_objects()
+        return self._managed_objects
 
-        for service in self.services:
-            response[service.get_path()] = service.get_properties()
-            chrcs = service.get_characteristics()
-            for chrc in chrcs:
-                response[chrc.get_path()] = chrc.get_properties()
-                descs = chrc.get_descriptors()
-                for desc in descs:
-                    response[desc.get_path()] = desc.get_properties()
+    def build_managed_objects(self):
+        response = {}
+        for path, obj in self.objects.items():
+            response[path] = obj.get_properties()
 
         return response
 
+    @dbus.service.signal(DBUS_OM_IFACE, signature="oa{sa{sv}}")
+    def InterfacesAdded(self, path, interfaces):
+        pass
+
+    @dbus.service.signal(DBUS_OM_IFACE, signature="oas")
+    def InterfacesRemoved(self, path, interfaces):
+        pass
+
 
 class Service(dbus.service.Object):
     """
     org.bluez.GattService1 interface implementation
+
+    Characteristic classes listed in CHARACTERISTICS are created when the
+    service is, in order. Characteristics created with index None get the
+    next free path index under the service.
     """
 
     PATH_BASE = "/org/bluez/example/service"
 
+    CHARACTERISTICS = ()
+
     def __init__(self, bus, index, uuid, primary):
         self.path = self.PATH_BASE + str(index)
         self.bus = bus
         self.uuid = uuid
         self.primary = primary
-        self.characteristics = []
+        self.characteristics = collections.OrderedDict()
+        self.application = None
+        self._next_index = 0
+        self._properties = None
         dbus.service.Object.__init__(self, bus, self.path)
 
+        for chrc_class in self.CHARACTERISTICS:
+            self.add_characteristic(chrc_class(bus, None, self))
+
+    def next_index(self, index=None):
+        """
+        Returns index, or the next unused characteristic index if None
+        """
+        if index is None:
+            index = self._next_index
+        self._next_index = max(self._next_index, index + 1)
+        return index
+
     def get_properties(self):
-        return {
-            GATT_SERVICE_IFACE: {
-                "UUID": self.uuid,
-                "Primary": self.primary,
-                "Characteristics": dbus.Array(
-                    self.get_characteristic_paths(), signature="o"
-                ),
+        if self._properties is None:
+            self._properties = {
+                GATT_SERVICE_IFACE: {
+                    "UUID": self.uuid,
+                    "Primary": self.primary,
+                    "Characteristics": dbus.Array(
+                        self.get_characteristic_paths(), signature="o"
+                    ),
+                }
             }
-        }
+        return self._properties
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
     def add_characteristic(self, characteristic):
-        self.characteristics.append(characteristic)
+        self.characteristics[characteristic.get_path()] = characteristic
+        self._properties = None
+        if self.application is not None:
+            self.application.objects_added(characteristic)
+
+    def remove_characteristic(self, characteristic):
+        del self.characteristics[characteristic.get_path()]
+        self._properties = None
+        characteristic.release()
+        if self.application is not None:
+            self.application.objects_removed(characteristic)
+
+    def invalidate(self):
+        if self.application is not None:
+            self.application.invalidate()
+
+    def walk(self):
+        """
+        Returns this service followed by every object below it
+        """
+        result = [self]
+        for chrc in self.characteristics.values():
+            result.extend(chrc.walk())
+        return result
 
     def get_characteristic_paths(self):
-        result = []
-        for chrc in self.characteristics:
-            result.append(chrc.get_path())
-        return result
+        return list(self.characteristics.keys())
 
     def get_characteristics(self):
-        return self.characteristics
+        return list(self.characteristics.values())
 
     @dbus.service.method(DBUS_PROP_IFACE, in_signature="s", out_signature="a{sv}")
     def GetAll(self, interface):
@@ -136,44 +316,158 @@ class Service(dbus.service.Object):
         return self.get_properties()[GATT_SERVICE_IFACE]
 
 
+class DeviceCache(object):
+    """
+    Per-device values that expire `timeout` seconds after they were stored.
+    At most `max_devices` entries are kept; the oldest is evicted first.
+    """
+
+    def __init__(self, timeout, max_devices):
+        self.timeout = timeout
+        self.max_devices = max_devices
+        self._entries = collections.OrderedDict()
+
+    def get(self, device):
+        entry = self._entries.get(device)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.timeout:
+            del self._entries[device]
+            return None
+        return entry[1]
+
+    def put(self, device, value):
+        self._entries.pop(device, None)
+        self._entries[device] = (time.monotonic(), value)
+        while len(self._entries) > self.max_devices:
+            self._entries.popitem(last=False)
+
+    def pop(self, device):
+        entry = self._entries.pop(device, None)
+        return entry[1] if entry is not None else None
+
+
 class Characteristic(dbus.service.Object):
     """
     org.bluez.GattCharacteristic1 interface implementation
+
+    Subclasses implement read_value/write_value, which run on the worker
+    pool when offload is set, and notify_value for "notify" characteristics.
     """
 
+    acquire_write = False
+    acquire_notify = False
+
+    long_read_timeout = 30.0
+    max_long_devices = 16
+    max_write_length = 512
+
+    # descriptor classes created with the characteristic, in order
+    DESCRIPTORS = ()
+
+    offload = False
+
+    notify_period_ms = 0
+    notify_interval_ms = 30
+
     def __init__(self, bus, index, uuid, flags, service):
-        self.path = service.path + "/char" + str(index)
+        if self.acquire_write and self.offload:
+            raise ValueError("acquire_write and offload are exclusive")
+        self.path = service.path + "/char" + str(service.next_index(index))
         self.bus = bus
         self.uuid = uuid
         self.service = service
         self.flags = flags
-        self.descriptors = []
+        self.descriptors = collections.OrderedDict()
+        self._next_index = 0
+        self._properties = None
+        self.notify_subscribers = 0
+        self._notify_timer = None
+        self._flush_timer = None
+        self._pending_value = None
+        self._last_notified = None
+        self._last_notify_time = 0
+        self._long_reads = DeviceCache(
+            self.long_read_timeout, self.max_long_devices)
+        self._long_writes = DeviceCache(
+            self.long_read_timeout, self.max_long_devices)
+        self._write_socket = None
+        self._write_watch = None
+        self._write_options = None
+        self._write_mtu = 0
+        self._notify_socket = None
+        self._notify_watch = None
+        self.notify_mtu = 0
         dbus.service.Object.__init__(self, bus, self.path)
 
+        for desc_class in self.DESCRIPTORS:
+            self.add_descriptor(desc_class(bus, None, self))
+
+    def next_index(self, index=None):
+        """
+        Returns index, or the next unused descriptor index if None
+        """
+        if index is None:
+            index = self._next_index
+        self._next_index = max(self._next_index, index + 1)
+        return index
+
     def get_properties(self):
-        return {
-            GATT_CHRC_IFACE: {
-                "Service": self.service.get_path(),
-                "UUID": self.uuid,
-                "Flags": self.flags,
-                "Descriptors": dbus.Array(self.get_descriptor_paths(), signature="o"),
+        if self._properties is None:
+            self._properties = {
+                GATT_CHRC_IFACE: {
+                    "Service": self.service.get_path(),
+                    "UUID": self.uuid,
+                    "Flags": self.flags,
+                    "Descriptors": dbus.Array(
+                        self.get_descriptor_paths(), signature="o"
+                    ),
+                }
             }
-        }
+            # bluez only calls AcquireWrite/AcquireNotify when these exist
+            if self.acquire_write:
+                self._properties[GATT_CHRC_IFACE]["WriteAcquired"] = \
+                    dbus.Boolean(self._write_socket is not None)
+            if self.acquire_notify:
+                self._properties[GATT_CHRC_IFACE]["NotifyAcquired"] = \
+                    dbus.Boolean(self._notify_socket is not None)
+        return self._properties
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
     def add_descriptor(self, descriptor):
-        self.descriptors.append(descriptor)
+        self.descriptors[descriptor.get_path()] = descriptor
+        self._properties = None
+        if self.is_published():
+            self.service.application.objects_added(descriptor)
+
+    def remove_descriptor(self, descriptor):
+        del self.descriptors[descriptor.get_path()]
+        self._properties = None
+        if self.is_published():
+            self.service.application.objects_removed(descriptor)
+
+    def is_published(self):
+        """
+        Whether this characteristic is part of an application's tree yet;
+        descriptors added from a subclass __init__ are announced together
+        with the characteristic instead
+        """
+        return (self.service.application is not None and
+                self.get_path() in self.service.characteristics)
+
+    def invalidate(self):
+        self.service.invalidate()
+
+    def walk(self):
+        return [self] + list(self.descriptors.values())
 
     def get_descriptor_paths(self):
-        result = []
-        for desc in self.descriptors:
-            result.append(desc.get_path())
-        return result
+        return list(self.descriptors.keys())
 
     def get_descriptors(self):
-        return self.descriptors
+        return list(self.descriptors.values())
 
     @dbus.service.method(DBUS_PROP_IFACE, in_signature="s", out_signature="a{sv}")
     def GetAll(self, interface):
@@ -182,25 +476,329 @@ class Characteristic(dbus.service.Object):
 
         return self.get_properties()[GATT_CHRC_IFACE]
 
-    @dbus.service.method(GATT_CHRC_IFACE, in_signature="a{sv}", out_signature="ay")
-    def ReadValue(self, options):
+    def _dispatch(self, func, args, returns, reply_handler, error_handler):
+        def reply(result):
+            if returns:
+                reply_handler(value_bytes(result))
+            else:
+                reply_handler()
+
+        if not self.offload:
+            reply(func(*args))
+            return
+
+        def deliver(future):
+            error = future.exception()
+            if error is not None:
+                error_handler(error)
+            else:
+                reply(future.result())
+            return False
+
+        future = get_executor().submit(func, *args)
+        future.add_done_callback(lambda f: GLib.idle_add(deliver, f))
+
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature="a{sv}", out_signature="ay",
+                         async_callbacks=("reply_handler", "error_handler"))
+    @timed
+    def ReadValue(self, options, reply_handler, error_handler):
+        """
+        Values longer than one ATT packet are read as a snapshot: the value
+        read at offset 0 is kept per device (at most max_long_devices, for
+        long_read_timeout seconds) and later offsets are served from it, so
+        read_value runs once per long read
+        """
+        offset = int(options.get("offset", 0))
+        mtu = int(options.get("mtu", 0))
+        device = str(options.get("device", ""))
+
+        def reply(value):
+            if offset > len(value):
+                error_handler(InvalidOffsetException())
+            else:
+                reply_handler(value[offset:])
+
+        if offset:
+            snapshot = self._long_reads.get(device)
+            if snapshot is not None:
+                reply(snapshot)
+                return
+
+        def read_reply(value):
+            if not mtu or len(value) > mtu - 1:
+                self._long_reads.put(device, value)
+            reply(value)
+
+        self._dispatch(self.read_value, (options,), True,
+                       read_reply, error_handler)
+
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature="aya{sv}",
+                         async_callbacks=("reply_handler", "error_handler"),
+                         byte_arrays=True)
+    @timed
+    def WriteValue(self, value, options, reply_handler, error_handler):
+        value, options = self._assemble_write(value_bytes(value), options)
+        self._dispatch(self.write_value, (value, options), False,
+                       reply_handler, error_handler)
+
+    def _assemble_write(self, value, options):
+        """
+        bluez executes a long (prepared) write as one WriteValue per chunk,
+        the later ones at non-zero offsets. write_value runs for every
+        chunk, and each chunk is acknowledged only after it returned.
+
+        Returns the value written so far by this device and the options
+        to pass to write_value. options["complete"] is False when the
+        chunk filled a whole Prepare Write (mtu - 5 bytes), so the value
+        may still grow (bluez does not say which chunk is the last, so a
+        long write whose last chunk is exactly full is never reported
+        complete). write_value should treat a value that does not parse
+        yet as pending rather than as an error.
+        """
+        offset = int(options.get("offset", 0))
+        mtu = int(options.get("mtu", 0))
+        device = str(options.get("device", ""))
+        complete = not mtu or len(value) < mtu - 5
+        if offset:
+            partial = self._long_writes.get(device)
+            if partial is None or offset != len(partial):
+                self._long_writes.pop(device)
+                raise InvalidOffsetException()
+            value = partial + value
+            if len(value) > self.max_write_length:
+                self._long_writes.pop(device)
+                raise InvalidValueLengthException()
+        # any write may turn out to be the first chunk of a long write
+        self._long_writes.put(device, value)
+        return value, dict(options, complete=complete)
+
+    def read_value(self, options):
         logger.info("Default ReadValue called, returning error")
         raise NotSupportedException()
 
-    @dbus.service.method(GATT_CHRC_IFACE, in_signature="aya{sv}")
-    def WriteValue(self, value, options):
+    def write_value(self, value, options):
         logger.info("Default WriteValue called, returning error")
         raise NotSupportedException()
 
+    def notify_value(self):
+        """
+        Returns the current value to push to subscribers, or None to skip
+        this tick. Sampled every notify_period_ms while subscribed.
+        """
+        return None
+
+    def notify(self, value):
+        """
+        Pushes value to subscribers. Unchanged values are dropped and
+        updates faster than notify_interval_ms are coalesced into the
+        latest one.
+        """
+        if not self.notify_subscribers:
+            return
+        self._pending_value = value_bytes(value)
+        if self._flush_timer is not None:
+            return
+        wait = self._last_notify_time + \
+            self.notify_interval_ms / 1000.0 - time.monotonic()
+        if wait <= 0:
+            self._flush_notify()
+        else:
+            self._flush_timer = GLib.timeout_add(
+                int(wait * 1000) + 1, self._flush_notify)
+
+    def _flush_notify(self):
+        self._flush_timer = None
+        value, self._pending_value = self._pending_value, None
+        if value is None or value == self._last_notified:
+            return False
+        self._last_notified = value
+        self._last_notify_time = time.monotonic()
+        if self._notify_socket is not None:
+            self.send_notification(value)
+        else:
+            self.PropertiesChanged(
+                GATT_CHRC_IFACE, {"Value": dbus.ByteArray(value)}, [])
+        return False
+
+    def _notify_tick(self):
+        if not self.notify_subscribers:
+            self._notify_timer = None
+            return False
+        try:
+            value = self.notify_value()
+            if value is not None:
+                self.notify(value)
+        except Exception:
+            logger.exception("notify_value failed on %s" % self.path)
+        return True
+
     @dbus.service.method(GATT_CHRC_IFACE)
     def StartNotify(self):
-        logger.info("Default StartNotify called, returning error")
-        raise NotSupportedException()
+        if "notify" not in self.flags and "indicate" not in self.flags:
+            logger.info("Default StartNotify called, returning error")
+            raise NotSupportedException()
+        self.notify_subscribers += 1
+        if self.notify_subscribers > 1:
+            return
+        self._last_notified = None
+        if self.notify_period_ms:
+            self._notify_timer = GLib.timeout_add(
+                self.notify_period_ms, self._notify_tick)
+            self._notify_tick()
 
     @dbus.service.method(GATT_CHRC_IFACE)
     def StopNotify(self):
-        logger.info("Default StopNotify called, returning error")
-        raise NotSupportedException()
+        if "notify" not in self.flags and "indicate" not in self.flags:
+            logger.info("Default StopNotify called, returning error")
+            raise NotSupportedException()
+        if not self.notify_subscribers:
+            return
+        self.notify_subscribers -= 1
+        if not self.notify_subscribers:
+            self.cancel_notify()
+
+    def cancel_notify(self):
+        """
+        Stops pushing values and closes an acquired notify socket
+        """
+        self.notify_subscribers = 0
+        self._release_notify()
+        for source in (self._notify_timer, self._flush_timer):
+            if source is not None:
+                GLib.source_remove(source)
+        self._notify_timer = None
+        self._flush_timer = None
+        self._pending_value = None
+
+    def release(self):
+        """
+        Stops notifications and closes acquired sockets, e.g. when the
+        characteristic is removed
+        """
+        self.cancel_notify()
+        self._release_write()
+
+    def _acquired_changed(self, name, acquired):
+        self._properties = None
+        self.invalidate()
+        self.PropertiesChanged(
+            GATT_CHRC_IFACE, {name: dbus.Boolean(acquired)}, [])
+
+    def _acquire_socket(self, options, condition, callback):
+        local, remote = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        local.setblocking(False)
+        watch = GLib.io_add_watch(local.fileno(), condition, callback)
+        # UnixFd holds its own duplicate of the descriptor
+        fd = dbus.types.UnixFd(remote)
+        remote.close()
+        mtu = int(options.get("mtu", 23))
+        return local, watch, fd, mtu
+
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature="a{sv}", out_signature="hq")
+    def AcquireWrite(self, options):
+        """
+        With acquire_write and the "write-without-response" flag, bluez
+        hands write commands over this SOCK_SEQPACKET socket instead of
+        WriteValue calls. Each packet goes to write_value in order on the
+        mainloop, which is why acquire_write excludes offload.
+        """
+        if not self.acquire_write or "write-without-response" not in self.flags:
+            raise NotSupportedException()
+        if self._write_socket is not None:
+            raise NotPermittedException()
+        self._write_socket, self._write_watch, fd, mtu = self._acquire_socket(
+            options, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._on_write_socket)
+        self._write_options = dict(options)
+        self._write_mtu = mtu
+        self._acquired_changed("WriteAcquired", True)
+        return (fd, dbus.UInt16(mtu))
+
+    def _on_write_socket(self, fd, condition):
+        # handle a bounded batch per wakeup so a bulk transfer does not
+        # starve other mainloop sources
+        for _ in range(ACQUIRED_WRITE_BATCH):
+            try:
+                value = self._write_socket.recv(self._write_mtu)
+            except BlockingIOError:
+                return True
+            except OSError as e:
+                logger.warning("Write socket of %s failed: %s" % (self.path, e))
+                break
+            if not value:
+                break
+            try:
+                self.write_value(value, self._write_options)
+            except Exception:
+                logger.exception("write_value failed on %s" % self.path)
+        else:
+            return True
+        self._write_watch = None
+        self._release_write()
+        return False
+
+    def _release_write(self):
+        if self._write_socket is None:
+            return
+        if self._write_watch is not None:
+            GLib.source_remove(self._write_watch)
+        self._write_socket.close()
+        self._write_socket = None
+        self._write_watch = None
+        self._acquired_changed("WriteAcquired", False)
+
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature="a{sv}", out_signature="hq")
+    def AcquireNotify(self, options):
+        """
+        With acquire_notify and "notify", bluez subscribes through this
+        socket and notifications are written to it instead of being sent
+        as PropertiesChanged signals
+        """
+        if not self.acquire_notify or ("notify" not in self.flags and
+                                       "indicate" not in self.flags):
+            raise NotSupportedException()
+        if self._notify_socket is not None:
+            raise NotPermittedException()
+        # bluez closes its end when the last client unsubscribes
+        self._notify_socket, self._notify_watch, fd, mtu = self._acquire_socket(
+            options, GLib.IO_HUP | GLib.IO_ERR, self._on_notify_socket)
+        # ATT notifications carry up to mtu - 3 bytes of value
+        self.notify_mtu = mtu - 3
+        self._acquired_changed("NotifyAcquired", True)
+        self.StartNotify()
+        return (fd, dbus.UInt16(mtu))
+
+    def _on_notify_socket(self, fd, condition):
+        self._notify_watch = None
+        self.cancel_notify()
+        return False
+
+    def _release_notify(self):
+        if self._notify_socket is None:
+            return
+        if self._notify_watch is not None:
+            GLib.source_remove(self._notify_watch)
+        self._notify_socket.close()
+        self._notify_socket = None
+        self._notify_watch = None
+        self._acquired_changed("NotifyAcquired", False)
+
+    def send_notification(self, value):
+        """
+        Writes one notification of at most notify_mtu bytes to the acquired
+        socket. Returns False when notifications are not acquired or the
+        socket is full, in which case the caller should retry later.
+        """
+        if self._notify_socket is None:
+            return False
+        try:
+            self._notify_socket.send(value_bytes(value))
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            logger.warning("Notify socket of %s failed: %s" % (self.path, e))
+            self.cancel_notify()
+            return False
+        return True
 
     @dbus.service.signal(DBUS_PROP_IFACE, signature="sa{sv}as")
     def PropertiesChanged(self, interface, changed, invalidated):
@@ -213,25 +811,32 @@ class Descriptor(dbus.service.Object):
     """
 
     def __init__(self, bus, index, uuid, flags, characteristic):
-        self.path = characteristic.path + "/desc" + str(index)
+        self.path = characteristic.path + "/desc" + \
+            str(characteristic.next_index(index))
         self.bus = bus
         self.uuid = uuid
         self.flags = flags
         self.chrc = characteristic
+        self._properties = None
         dbus.service.Object.__init__(self, bus, self.path)
 
     def get_properties(self):
-        return {
-            GATT_DESC_IFACE: {
-                "Characteristic": self.chrc.get_path(),
-                "UUID": self.uuid,
-                "Flags": self.flags,
+        if self._properties is None:
+            self._properties = {
+                GATT_DESC_IFACE: {
+                    "Characteristic": self.chrc.get_path(),
+                    "UUID": self.uuid,
+                    "Flags": self.flags,
+                }
             }
-        }
+        return self._properties
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
+    def walk(self):
+        return [self]
+
     @dbus.service.method(DBUS_PROP_IFACE, in_signature="s", out_signature="a{sv}")
     def GetAll(self, interface):
         if interface != GATT_DESC_IFACE:
@@ -244,7 +849,8 @@ class Descriptor(dbus.service.Object):
         logger.info("Default ReadValue called, returning error")
         raise NotSupportedException()
 
-    @dbus.service.method(GATT_DESC_IFACE, in_signature="aya{sv}")
+    @dbus.service.method(GATT_DESC_IFACE, in_signature="aya{sv}",
+                         byte_arrays=True)
     def WriteValue(self, value, options):
         logger.info("Default WriteValue called, returning error")
         raise NotSupportedException()
@@ -326,6 +932,7 @@ class Advertisement(dbus.service.Object):
         self.data[ad_type] = dbus.Array(data, signature="y")
 
     @dbus.service.method(DBUS_PROP_IFACE, in_signature="s", out_signature="a{sv}")
+    @timed
     def GetAll(self, interface):
         logger.info("GetAll")
         if interface != LE_ADVERTISEMENT_IFACE:
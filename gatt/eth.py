@@ -1,18 +1,165 @@
-from eth_account import Account
-from eth_account.messages import encode_defunct
-from web3.auto import w3
-from web3 import Web3
+import logging
+import os
+import threading
 
+import ecc_2
+
+try:
+    from Crypto.Hash import keccak as _keccak
+
+    def keccak(data):
+        return _keccak.new(digest_bits=256, data=data).digest()
+except ImportError:
+    import sha3
+
+    def keccak(data):
+        return sha3.keccak_256(data).digest()
+
+
+logger = logging.getLogger(__name__)
 
 WALLET_SEED = "ridge mystery enact hover spell vanish element stove street yard metal reflect"
 WALLET_ADDRESS = "0x5B78b008d4801a4FFae138ed3890eDBFa2de5f2D"
 
-Account.enable_unaudited_hdwallet_features()
-ETH_ACCOUNT = Account.from_mnemonic(WALLET_SEED)
+# The key derived from WALLET_SEED is cached here (mode 0600) so the BIP-39
+# derivation, and the eth_account import it needs, only run once
+KEY_FILE = os.environ.get(
+    "DIMO_GATT_KEY_FILE", os.path.expanduser("~/.dimo_gatt/key"))
+
+
+def eip191_hash(msg):
+    """
+    Returns the EIP-191 personal_sign digest of a text or bytes message
+    """
+    if isinstance(msg, str):
+        msg = msg.encode("utf-8")
+    return keccak(b"\x19Ethereum Signed Message:\n" +
+                  str(len(msg)).encode("utf-8") + msg)
+
+
+def public_key_to_address(public_key):
+    """
+    Returns the EIP-55 checksummed address of an (x, y) public key
+    """
+    address = keccak(ecc_2.encode_int32(public_key[0]) +
+                     ecc_2.encode_int32(public_key[1]))[-20:].hex()
+    checksum = keccak(address.encode("ascii")).hex()
+    return "0x" + "".join(
+        c.upper() if int(checksum[i], 16) >= 8 else c
+        for i, c in enumerate(address))
+
+
+def derive_private_key(seed=WALLET_SEED):
+    from eth_account import Account
+
+    Account.enable_unaudited_hdwallet_features()
+    return bytes(Account.from_mnemonic(seed).key)
+
+
+def _write_key_file(path, key):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "w") as key_file:
+        key_file.write(key.hex())
+    os.rename(tmp_path, path)
+
+
+def load_private_key(path=KEY_FILE, address=WALLET_ADDRESS):
+    """
+    Returns the cached private key for address, deriving it from the wallet
+    seed and caching it when the file is missing or holds another key
+    """
+    try:
+        with open(path) as key_file:
+            key = bytes.fromhex(key_file.read().strip())
+        if public_key_to_address(ecc_2.privtopub(key)) == address:
+            return key
+        logger.warning("Key in %s is not for %s, re-deriving" % (path, address))
+    except (OSError, ValueError):
+        pass
+
+    key = derive_private_key()
+    try:
+        _write_key_file(path, key)
+    except OSError as e:
+        logger.warning("Could not cache private key in %s: %s" % (path, e))
+    return key
+
+
+class MessageSigner(object):
+    """
+    Signs EIP-191 messages with a private key that is parsed once, using
+    ecc_2 and keccak only
+    """
+
+    SELF_CHECK_DIGEST = keccak(b"dimo-gatt signer self-check")
+
+    def __init__(self, private_key):
+        self._key = bytes(private_key)
+        self.public_key = ecc_2.privtopub(self._key)
+        self.address = public_key_to_address(self.public_key)
+
+        vrs = ecc_2.ecdsa_raw_sign(self.SELF_CHECK_DIGEST, self._key)
+        if ecc_2.ecdsa_raw_recover(self.SELF_CHECK_DIGEST, vrs) != \
+                self.public_key:
+            raise ValueError("Signer self-check failed for %s" % self.address)
+
+    def sign_digest(self, digest):
+        """
+        Returns the 65 byte r || s || v signature of a 32 byte digest, with
+        v in 27/28 like eth_account
+        """
+        v, r, s = ecc_2.ecdsa_raw_sign(bytes(digest), self._key)
+        return ecc_2.encode_int32(r) + ecc_2.encode_int32(s) + bytes([v])
+
+    def sign_message(self, msg):
+        return "0x" + self.sign_digest(eip191_hash(msg)).hex()
+
+
+_signer = None
+_signer_lock = threading.Lock()
+
+
+def get_signer():
+    """
+    Returns the MessageSigner for the wallet key, loading the key on first
+    use so importing this module stays cheap
+    """
+    global _signer
+    with _signer_lock:
+        if _signer is None:
+            _signer = MessageSigner(load_private_key())
+        return _signer
+
+
+def set_signer(signer):
+    global _signer
+    with _signer_lock:
+        _signer = signer
+
+
+def web3_sign_message(msg):
+    """
+    Reference signing path through eth_account, imported on first use
+    """
+    from eth_account import Account
+    from eth_account.messages import encode_defunct
+
+    signed_message = Account.sign_message(
+        encode_defunct(text=msg), private_key=get_signer()._key)
+    return "0x" + bytes(signed_message.signature).hex()
 
 
 def sign_message(msg):
-    message = encode_defunct(text=msg)
-    signed_message = w3.eth.account.sign_message(
-        message, private_key=ETH_ACCOUNT._private_key)
-    return Web3.toHex(signed_message.signature)
+    return get_signer().sign_message(msg)
+
+
+def sign_message_raw(msg):
+    """
+    Returns the raw 65 byte r || s || v EIP-191 signature of a message
+    """
+    return get_signer().sign_digest(eip191_hash(msg))
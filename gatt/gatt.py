@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 
-import traceback
 # from eth_account.account import Account
 # from eth_account.messages import encode_defunct, defunct_hash_message
 import logging
 import os
 import struct
+import time
 import array
 from enum import Enum
 
@@ -22,14 +22,18 @@ from gatt.ble import (
     Application,
     find_adapter,
     Descriptor,
+    value_bytes,
 )
 import datetime
 import json
-from gatt.eth import sign_message
+from gatt.eth import sign_message, sign_message_raw
+from gatt.log import setup_logging
+from gatt import stats
+from gatt.sensors import TemperatureSampler, format_temp
+from gatt.tokens import TokenPool
 from gatt.utils import *
-import subprocess
 from gatt.agent import Agent
-from gatt.autoconnect import listDevices
+from gatt.autoconnect import DeviceRegistry, ReconnectScheduler
 # Mainloop
 MainLoop = None
 try:
@@ -37,22 +41,13 @@ try:
 
     MainLoop = GLib.MainLoop
 except ImportError:
-    import gobject as GObject
+    import gobject as GLib
 
-    MainLoop = GObject.MainLoop
+    MainLoop = GLib.MainLoop
 
 
-# Logging
+# Logging, configured by setup_logging() in main()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-logHandler = logging.StreamHandler()
-filelogHandler = logging.FileHandler("logs.log")
-formatter = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-logHandler.setFormatter(formatter)
-filelogHandler.setFormatter(formatter)
-logger.addHandler(filelogHandler)
-logger.addHandler(logHandler)
 
 # Service
 mainloop = None
@@ -65,6 +60,7 @@ LE_ADVERTISING_MANAGER_IFACE = "org.bluez.LEAdvertisingManager1"
 
 
 bus = None
+reconnect_scheduler = None
 
 # Callbacks
 
@@ -89,33 +85,58 @@ def register_ad_error_cb(error):
 
 # Classes
 
-class AutoPiS1Service(Service):
-    """
-    Dummy test service that provides characteristics and descriptors that
-    exercise various API functionality.
+def dump_json(data):
+    return json.dumps(data, separators=(',', ':'))
 
-    """
 
-    SVC_UUID = '58de7278-4723-48a9-8af5-c524617103bd'
+def signed_token():
+    token = {"timestamp": datetime.datetime.now().isoformat()}
+    signature = sign_message(dump_json(token))
+    return str.encode(dump_json({"token": token, "signature": signature}))
 
-    def __init__(self, bus, index):
-        Service.__init__(self, bus, index, self.SVC_UUID, True)
-        self.add_characteristic(SignedToken(bus, 0, self))
-        IS_PAIRED, OWNER_ETH_ADDRESS, COMMUNICATION_PUBLIC_KEY = getEnvVars()
-        if(IS_PAIRED):
-            self.isPaired = True
-            self.comm_key = COMMUNICATION_PUBLIC_KEY
-            self.add_characteristic(CPUTemp(bus, 1, self))
-        else:
-            self.isPaired = False
-            self.comm_key = None
 
+# Compact token: big-endian epoch milliseconds followed by the raw r || s || v
+# EIP-191 signature of those 8 bytes, 73 bytes instead of ~230 for the JSON
+COMPACT_TOKEN_FORMAT = ">Q"
 
-def dump_json(data):
-    return json.dumps(data, separators=(',', ':'))
+
+def compact_signed_token():
+    payload = struct.pack(COMPACT_TOKEN_FORMAT, int(time.time() * 1000))
+    return payload + sign_message_raw(payload)
+
+
+# Tokens are minted once per second and served for up to five
+TOKEN_POOL_GRANULARITY = 1.0
+TOKEN_POOL_TTL = 5.0
+
+token_pool = TokenPool(signed_token, granularity=TOKEN_POOL_GRANULARITY,
+                       ttl=TOKEN_POOL_TTL)
+compact_token_pool = TokenPool(compact_signed_token,
+                               granularity=TOKEN_POOL_GRANULARITY,
+                               ttl=TOKEN_POOL_TTL)
+
+# At most this many Device1.Connect calls are outstanding; failing devices
+# are retried with exponential backoff up to RECONNECT_MAX_BACKOFF seconds
+RECONNECT_IN_FLIGHT = 4
+RECONNECT_MAX_BACKOFF = 300.0
+# Devices the daemon disconnects itself are not reconnected for this long
+RECONNECT_HOLD = 60.0
+
+# Pairing state is re-read this often; the paired-only characteristics
+# are registered as their own GATT application at PAIRED_APP_PATH
+PAIRING_POLL_SECONDS = 10
+PAIRED_APP_PATH = "/dimo/paired"
+
+# CPU temperature is sampled in the background and served from cache
+SENSOR_PERIOD = 1.0
+SENSOR_TTL = 5.0
+
+temperature_sampler = TemperatureSampler(period=SENSOR_PERIOD, ttl=SENSOR_TTL)
 
 
 def dev_disconnect(path):
+    if reconnect_scheduler is not None:
+        reconnect_scheduler.hold(path, RECONNECT_HOLD)
     dev = dbus.Interface(bus.get_object("org.bluez", path),
                          "org.bluez.Device1")
 
@@ -132,6 +153,9 @@ def dev_connect(path):
 class SignedToken(Characteristic):
     uuid = 'ce878653-8c44-4326-84e5-3be6c0fa341f'
     description = b'signed token'
+    DESCRIPTORS = (CharacteristicUserDescriptionDescriptor,)
+    # an empty token pool signs inline, which must not block the mainloop
+    offload = True
 
     def __init__(self, bus, index, service):
         Characteristic.__init__(
@@ -139,44 +163,67 @@ class SignedToken(Characteristic):
                 "read", "write"], service,
         )
 
-        self.value = [0xFF]
-        self.add_descriptor(
-            CharacteristicUserDescriptionDescriptor(bus, 1, self))
-
-    def ReadValue(self, options):
+        self.value = b"\xff"
 
-        token = {"timestamp": datetime.datetime.now().isoformat()}
-        signature = sign_message(dump_json(token))
-        #signature = dump_json(token)
-        signedToken = dump_json({"token": token, "signature": signature})
-        logger.info(signedToken)
-        return str.encode(signedToken)
+    def read_value(self, options):
+        signedToken = token_pool.pop()
+        logger.debug("Serving token %s" % signedToken)
+        return signedToken
 
-    def WriteValue(self, value, options):
-        logger.info(options)
-        logger.info(options["device"])
+    def write_value(self, value, options):
+        logger.debug("Write from %s: %r" % (options.get("device"), value))
+        if not options.get("complete", True):
+            # a long write may split a multi-byte character; wait for the
+            # last chunk before decoding and disconnecting
+            logger.debug("Waiting for the rest of the write")
+            return None
         dev_disconnect(options["device"])
-        logger.info("Test Write: " + repr(value))
-        cmd = bytes(value).decode("utf-8")
-        logger.info("Decoded: " + cmd)
+        cmd = value_bytes(value).decode("utf-8")
+        logger.debug("Decoded: " + cmd)
         #os.system('autopi audio.speak "' + cmd + '"')
 
         return None
 
 
+class CompactSignedToken(Characteristic):
+    """
+    Same token as SignedToken in the compact binary encoding, see
+    compact_signed_token(). Clients that do not know this UUID keep
+    reading the JSON token.
+    """
+
+    uuid = 'ce878655-8c44-4326-84e5-3be6c0fa341f'
+    description = b'signed token (compact)'
+    DESCRIPTORS = (CharacteristicUserDescriptionDescriptor,)
+    offload = True
+
+    def __init__(self, bus, index, service):
+        Characteristic.__init__(
+            self, bus, index, self.uuid, ["read"], service,
+        )
+
+    def read_value(self, options):
+        return compact_token_pool.pop()
+
+
 class CPUTemp(Characteristic):
     uuid = 'ce878654-8c44-4326-84e5-3be6c0fa341f'
     description = b'CPU temp'
+    # token verification runs on the worker pool
+    offload = True
+    # subscribers get the cached temperature pushed once per sample period
+    notify_period_ms = int(SENSOR_PERIOD * 1000)
 
     def __init__(self, bus, index, service):
         Characteristic.__init__(
             self, bus, index, self.uuid, [
-                "read", "write"], service,
+                "read", "write", "notify"], service,
         )
         IS_PAIRED, OWNER_ETH_ADDRESS, COMMUNICATION_PUBLIC_KEY = getEnvVars()
         self.isPaired = IS_PAIRED
         self.comm_key = COMMUNICATION_PUBLIC_KEY
         self.value = ""
+        self.authorized = False
 
     def verify_token(self, data):
         return True
@@ -192,23 +239,116 @@ class CPUTemp(Characteristic):
         # else:
         #     return False
 
-    def ReadValue(self, options):
+    def notify_value(self):
+        if self.authorized:
+            return str.encode(format_temp(temperature_sampler.latest()))
+        return None
+
+    def read_value(self, options):
+        if self.authorized:
+            self.value = format_temp(temperature_sampler.latest())
         return str.encode(self.value)
 
-    def WriteValue(self, value, options):
+    def write_value(self, value, options):
         try:
-            val_str = bytes(value).decode("utf-8")
-            print(options, val_str)
-            data = json.loads(val_str)
-            if(self.verify_token(data)):
-                self.value = subprocess.check_output(
-                    ["vcgencmd", "measure_temp"]).decode("utf-8").split("\n")[0]
+            try:
+                val_str = value_bytes(value).decode("utf-8")
+                data = json.loads(val_str)
+            except ValueError:
+                if options.get("complete", True):
+                    raise
+                logger.debug("Token from %s incomplete, waiting for more" %
+                             options.get("device"))
+                return
+            logger.debug("Write from %s: %s" % (options.get("device"), val_str))
+            self.authorized = self.verify_token(data)
+            if(self.authorized):
+                self.value = format_temp(temperature_sampler.latest())
             else:
                 self.value = "error"
-                print(options["device"])
+                logger.debug("Unauthorized, disconnecting %s" %
+                             options["device"])
                 dev_disconnect(options["device"])
-        except:
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Token write to %s failed" % self.path)
+
+
+class AutoPiS1Service(Service):
+    """
+    Dummy test service that provides characteristics and descriptors that
+    exercise various API functionality.
+
+    """
+
+    SVC_UUID = '58de7278-4723-48a9-8af5-c524617103bd'
+    CHARACTERISTICS = (SignedToken, CompactSignedToken)
+
+    def __init__(self, bus, index):
+        Service.__init__(self, bus, index, self.SVC_UUID, True)
+
+
+class AutoPiPairedService(Service):
+    """
+    Second instance of the AutoPi service holding the characteristics that
+    only exist while paired. It lives in its own application, see
+    PairedApplication.
+    """
+
+    PATH_BASE = PAIRED_APP_PATH + "/service"
+
+    SVC_UUID = AutoPiS1Service.SVC_UUID
+    CHARACTERISTICS = (CPUTemp,)
+
+    def __init__(self, bus, index):
+        Service.__init__(self, bus, index, self.SVC_UUID, True)
+
+
+class PairedApplication(object):
+    """
+    Registers the paired-only characteristics as a GATT application of
+    their own while getEnvVars() reports the device as paired, and
+    unregisters it once unpaired. bluez builds its attribute table at
+    RegisterApplication, so this is how pairing can change at runtime.
+    refresh() runs on a timer and returns True to keep it.
+    """
+
+    def __init__(self, bus, service_manager):
+        self.bus = bus
+        self.service_manager = service_manager
+        self.app = None
+
+    def refresh(self):
+        IS_PAIRED, OWNER_ETH_ADDRESS, COMMUNICATION_PUBLIC_KEY = getEnvVars()
+        if IS_PAIRED and self.app is None:
+            logger.info("Paired, registering paired characteristics")
+            self.app = Application(self.bus, PAIRED_APP_PATH)
+            self.app.add_service(AutoPiPairedService(self.bus, 0))
+            self.service_manager.RegisterApplication(
+                self.app.get_path(), {},
+                reply_handler=self._registered,
+                error_handler=self._register_failed)
+        elif not IS_PAIRED and self.app is not None:
+            logger.info("Unpaired, unregistering paired characteristics")
+            app, self.app = self.app, None
+            # released first so re-pairing can reuse the paths right away
+            app.release()
+            self.service_manager.UnregisterApplication(
+                app.get_path(),
+                reply_handler=self._unregistered,
+                error_handler=self._unregister_failed)
+        return True
+
+    def _registered(self):
+        logger.info("Paired GATT application registered")
+
+    def _register_failed(self, error):
+        logger.error("Failed to register paired application: %s" % error)
+
+    def _unregistered(self):
+        logger.info("Paired GATT application unregistered")
+
+    def _unregister_failed(self, error):
+        logger.warning("Failed to unregister paired application: %s" % error)
 
 
 class AutoPiAdvertisement(Advertisement):
@@ -243,8 +383,13 @@ def extract_uuids(uuid_list):
 def main():
     global mainloop
     global bus
+    global reconnect_scheduler
+
+    setup_logging()
 
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    # characteristic handlers may make D-Bus calls from worker threads
+    dbus.mainloop.glib.threads_init()
 
     IS_PAIRED, OWNER_ETH_ADDRESS, COMMUNICATION_PUBLIC_KEY = getEnvVars()
     if IS_PAIRED:
@@ -289,19 +434,25 @@ def main():
     agent_manager.RegisterAgent(agent_path, capability)
     agent_manager.RequestDefaultAgent(agent_path)
     logger.info("Agent registered")
-    # logger.info("Attempting to connect to trusted devices")
 
-    # try:
-    #     # device_paths = listDevices(logger)
-    #     device_paths = ["/org/bluez/hci0/dev_F4_65_A6_D0_17_E0"]
-    #     for device_path in device_paths:
-    #         logger.info("Connecting to %s" % device_path)
-    #         dev_connect(device_path)
-    # except Exception as e:
-    #     logger.error(traceback.format_exc())
+    # trusted devices are reconnected in the background once the mainloop
+    # runs, so unreachable phones do not hold up startup
+    device_registry = DeviceRegistry(bus)
+    device_registry.start()
+    reconnect_scheduler = ReconnectScheduler(
+        bus, device_registry, max_in_flight=RECONNECT_IN_FLIGHT,
+        max_backoff=RECONNECT_MAX_BACKOFF)
+    reconnect_scheduler.start()
 
     app = Application(bus)
-    app.add_service(AutoPiS1Service(bus, 0))
+    service = AutoPiS1Service(bus, 0)
+    app.add_service(service)
+    paired_app = PairedApplication(bus, service_manager)
+
+    token_pool.start()
+    compact_token_pool.start()
+    temperature_sampler.start()
+    stats.install()
 
     mainloop = MainLoop()
 
@@ -321,6 +472,9 @@ def main():
         error_handler=register_app_error_cb,
     )
 
+    paired_app.refresh()
+    GLib.timeout_add_seconds(PAIRING_POLL_SECONDS, paired_app.refresh)
+
     mainloop.run()
 
 
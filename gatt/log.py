@@ -0,0 +1,114 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# Configuration read by setup_logging(), so the daemon's log level and
+# destination can change without editing code
+LOG_LEVEL = os.environ.get("DIMO_GATT_LOG_LEVEL", "INFO")
+# An empty DIMO_GATT_LOG_FILE logs to stderr only
+LOG_FILE = os.environ.get("DIMO_GATT_LOG_FILE", "logs.log")
+LOG_MAX_BYTES = int(os.environ.get("DIMO_GATT_LOG_MAX_BYTES", 1024 * 1024))
+LOG_BACKUPS = int(os.environ.get("DIMO_GATT_LOG_BACKUPS", 3))
+LOG_STDERR = os.environ.get("DIMO_GATT_LOG_STDERR", "1") != "0"
+# Each call site may log this many INFO/DEBUG lines per second, with bursts
+# up to LOG_BURST; WARNING and above are never dropped
+LOG_RATE = float(os.environ.get("DIMO_GATT_LOG_RATE", 5.0))
+LOG_BURST = int(os.environ.get("DIMO_GATT_LOG_BURST", 20))
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site (logger, file and line) for records below
+    WARNING. A record that gets through after some were dropped reports
+    how many were suppressed.
+    """
+
+    def __init__(self, rate=LOG_RATE, burst=LOG_BURST):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(
+                key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.msg = "%s (%d similar messages suppressed)" % (
+                record.getMessage(), suppressed)
+            record.args = None
+        return True
+
+
+def setup_logging(level=None, filename=None, stderr=None, rate=None):
+    """
+    Routes the gatt loggers through a queue to a background thread that
+    writes to stderr and a size-rotated file, so log I/O never blocks the
+    mainloop. Arguments left as None come from the DIMO_GATT_LOG_*
+    environment variables. Calling it again replaces the pipeline.
+    """
+    global _listener
+
+    level = LOG_LEVEL if level is None else level
+    filename = LOG_FILE if filename is None else filename
+    stderr = LOG_STDERR if stderr is None else stderr
+    rate = LOG_RATE if rate is None else rate
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    if stderr:
+        handlers.append(logging.StreamHandler())
+    if filename:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    stop_logging()
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate=rate))
+
+    logger = logging.getLogger("gatt")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """
+    Flushes queued records and stops the writer thread
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
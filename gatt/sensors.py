@@ -0,0 +1,90 @@
+import collections
+import glob
+import logging
+import os
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Kernel thermal zones report millidegrees Celsius. Point this at a fake
+# sysfs tree (or pass source_glob) to run without the real hardware.
+THERMAL_ZONE_GLOB = os.environ.get(
+    "DIMO_GATT_THERMAL_GLOB", "/sys/class/thermal/thermal_zone*/temp")
+
+
+def format_temp(celsius):
+    """
+    Formats a temperature the way `vcgencmd measure_temp` prints it
+    """
+    return "temp=%.1f'C" % celsius
+
+
+class TemperatureSampler(object):
+    """
+    Samples the CPU temperature from sysfs (falling back to vcgencmd) on a
+    background thread into a ring buffer of the last `history` samples
+
+    latest() serves the newest sample while it is younger than `ttl` and
+    only reads the sensor inline when the sampler is not keeping up.
+    """
+
+    def __init__(self, period=1.0, ttl=5.0, history=60,
+                 source_glob=THERMAL_ZONE_GLOB):
+        self.period = period
+        self.ttl = ttl
+        self.source_glob = source_glob
+        self.samples = collections.deque(maxlen=history)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="temperature-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def read_sysfs(self):
+        for path in sorted(glob.glob(self.source_glob)):
+            try:
+                with open(path) as zone:
+                    return int(zone.read().strip()) / 1000.0
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def read_vcgencmd(self):
+        output = subprocess.check_output(
+            ["vcgencmd", "measure_temp"]).decode("utf-8").split("\n")[0]
+        return float(output.split("=")[1].split("'")[0])
+
+    def sample(self):
+        celsius = self.read_sysfs()
+        if celsius is None:
+            celsius = self.read_vcgencmd()
+        self.samples.append((time.monotonic(), celsius))
+        return celsius
+
+    def latest(self):
+        if self.samples:
+            taken, celsius = self.samples[-1]
+            if time.monotonic() - taken < self.ttl:
+                return celsius
+        return self.sample()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Temperature sample failed")
+            self._stopped.wait(self.period)
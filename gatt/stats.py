@@ -0,0 +1,245 @@
+import functools
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+try:
+    from gi.repository import GLib
+except ImportError:
+    import gobject as GLib
+
+logger = logging.getLogger(__name__)
+
+# Latencies are kept in microseconds in log-linear buckets, like an HDR
+# histogram with SUB_BUCKETS buckets per power of two (about 12% error)
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+# Bucket bounds, in seconds, of the exported Prometheus histogram
+PROMETHEUS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                      0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# When set, install() serves the Prometheus text on this unix socket
+STATS_SOCKET = os.environ.get("DIMO_GATT_STATS_SOCKET", "")
+
+
+def bucket_index(us):
+    if us < 2 * SUB_BUCKETS:
+        return us
+    shift = us.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift << SUB_BUCKET_BITS) + (us >> shift)
+
+
+def bucket_upper(index):
+    """
+    Returns the exclusive upper bound, in microseconds, of a bucket
+    """
+    if index < 2 * SUB_BUCKETS:
+        return index + 1
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    return (index - (shift << SUB_BUCKET_BITS) + 1) << shift
+
+
+class Histogram(object):
+    """
+    Sparse log-linear latency histogram
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds, error=False):
+        index = bucket_index(int(seconds * 1e6))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+
+    def percentile(self, percent):
+        """
+        Returns the upper bound in seconds of the bucket holding the given
+        percentile, or 0 when empty
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(bucket_upper(index) / 1e6, self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        """
+        Returns the number of samples at or below each bound in seconds
+        """
+        counts = []
+        items = sorted(self.buckets.items())
+        for bound in bounds:
+            limit = bound * 1e6
+            counts.append(sum(n for index, n in items
+                              if bucket_upper(index) <= limit))
+        return counts
+
+
+class Stats(object):
+    """
+    Latency histograms, call counts and error counts per (method, object),
+    where object is the UUID of a GATT object or the path of others
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, obj, seconds, error=False):
+        key = (method, obj)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.record(seconds, error)
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def dump(self):
+        """
+        Returns a human readable summary, one line per method and object
+        """
+        lines = ["%-18s %-38s %8s %6s %9s %9s %9s %9s" % (
+            "method", "object", "count", "errors",
+            "p50 ms", "p90 ms", "p99 ms", "max ms")]
+        with self._lock:
+            for (method, obj), h in sorted(self.histograms.items()):
+                lines.append("%-18s %-38s %8d %6d %9.3f %9.3f %9.3f %9.3f" % (
+                    method, obj, h.count, h.errors, h.percentile(50) * 1e3,
+                    h.percentile(90) * 1e3, h.percentile(99) * 1e3,
+                    h.max * 1e3))
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """
+        Returns the stats in the Prometheus text exposition format
+        """
+        lines = [
+            "# HELP gatt_request_duration_seconds D-Bus handler latency",
+            "# TYPE gatt_request_duration_seconds histogram",
+        ]
+        errors = [
+            "# HELP gatt_request_errors_total D-Bus handler errors",
+            "# TYPE gatt_request_errors_total counter",
+        ]
+        with self._lock:
+            for (method, obj), h in sorted(self.histograms.items()):
+                labels = 'method="%s",object="%s"' % (method, obj)
+                for bound, count in zip(PROMETHEUS_BUCKETS,
+                                        h.cumulative(PROMETHEUS_BUCKETS)):
+                    lines.append('gatt_request_duration_seconds_bucket'
+                                 '{%s,le="%g"} %d' % (labels, bound, count))
+                lines.append('gatt_request_duration_seconds_bucket'
+                             '{%s,le="+Inf"} %d' % (labels, h.count))
+                lines.append("gatt_request_duration_seconds_sum{%s} %.6f" %
+                             (labels, h.total))
+                lines.append("gatt_request_duration_seconds_count{%s} %d" %
+                             (labels, h.count))
+                errors.append("gatt_request_errors_total{%s} %d" %
+                              (labels, h.errors))
+        return "\n".join(lines + errors) + "\n"
+
+
+STATS = Stats()
+
+
+def timed(func):
+    """
+    Records the latency of a D-Bus method in STATS. Methods with
+    async_callbacks are timed until reply_handler or error_handler runs.
+    Goes below @dbus.service.method, which reads the wrapped signature.
+    """
+    method = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        start = time.monotonic()
+        obj = getattr(self, "uuid", None) or getattr(self, "path", "")
+        reply_handler = kwargs.get("reply_handler")
+        error_handler = kwargs.get("error_handler")
+
+        if reply_handler is not None:
+            def timed_reply(*result):
+                STATS.record(method, obj, time.monotonic() - start)
+                reply_handler(*result)
+
+            def timed_error(error):
+                STATS.record(method, obj, time.monotonic() - start, True)
+                error_handler(error)
+
+            kwargs["reply_handler"] = timed_reply
+            kwargs["error_handler"] = timed_error
+
+        try:
+            result = func(self, *args, **kwargs)
+        except Exception:
+            STATS.record(method, obj, time.monotonic() - start, True)
+            raise
+        if reply_handler is None:
+            STATS.record(method, obj, time.monotonic() - start)
+        return result
+    return wrapper
+
+
+def _dump_on_signal(*args):
+    logger.warning("Request stats:\n%s" % STATS.dump())
+    return True
+
+
+def _serve(server, condition):
+    try:
+        conn, _ = server.accept()
+    except OSError:
+        return True
+    try:
+        conn.settimeout(1.0)
+        conn.sendall(STATS.prometheus().encode("utf-8"))
+    except OSError as e:
+        logger.warning("Could not send stats: %s" % e)
+    finally:
+        conn.close()
+    return True
+
+
+def install(signum=signal.SIGUSR1, path=STATS_SOCKET):
+    """
+    Logs STATS.dump() when the process gets signum and, with a path,
+    serves STATS.prometheus() to every connection on that unix socket
+    (e.g. `socat - UNIX-CONNECT:path`). Needs a running GLib mainloop.
+    """
+    if hasattr(GLib, "unix_signal_add"):
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, _dump_on_signal)
+    else:
+        signal.signal(signum, _dump_on_signal)
+
+    if not path:
+        return None
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(4)
+    server.setblocking(False)
+    GLib.io_add_watch(server.fileno(), GLib.IO_IN, lambda fd, condition:
+                      _serve(server, condition))
+    return server
@@ -0,0 +1,88 @@
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenPool(object):
+    """
+    Pool of pre-signed tokens for SignedToken.ReadValue
+
+    A daemon thread mints a fresh token every `granularity` seconds, drops
+    tokens older than `ttl` and tops the pool back up to `size` after reads,
+    so a read only has to pop a ready bytes value. pop() falls back to
+    calling the factory inline when the pool is empty or not started.
+    """
+
+    def __init__(self, factory, granularity=1.0, ttl=5.0, size=4):
+        self.factory = factory
+        self.granularity = granularity
+        self.ttl = ttl
+        self.size = size
+        self._tokens = collections.deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="token-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def pop(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._tokens:
+                created, token = self._tokens.pop()
+                if now - created < self.ttl:
+                    break
+                self._tokens.clear()
+            else:
+                token = None
+        self._wakeup.set()
+        if token is None:
+            logger.debug("Token pool empty, signing inline")
+            token = self.factory()
+        return token
+
+    def _expire(self, now):
+        while self._tokens and now - self._tokens[0][0] >= self.ttl:
+            self._tokens.popleft()
+
+    def _needs_token(self, now):
+        with self._lock:
+            self._expire(now)
+            if len(self._tokens) < self.size:
+                return True
+            return now - self._tokens[-1][0] >= self.granularity
+
+    def _refill(self):
+        while not self._stopped.is_set() and \
+                self._needs_token(time.monotonic()):
+            token = self.factory()
+            with self._lock:
+                self._tokens.append((time.monotonic(), token))
+                while len(self._tokens) > self.size:
+                    self._tokens.popleft()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._refill()
+            except Exception:
+                logger.exception("Token pool refill failed")
+            self._wakeup.wait(self.granularity)
+            self._wakeup.clear()
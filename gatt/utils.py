@@ -1,4 +1,3 @@
-import array
 import dbus.exceptions
 
 from gatt.ble import Descriptor
@@ -37,8 +36,7 @@ class CharacteristicUserDescriptionDescriptor(Descriptor):
         self, bus, index, characteristic,
     ):
 
-        self.value = array.array("B", characteristic.description)
-        self.value = self.value.tolist()
+        self.value = bytes(characteristic.description)
         Descriptor.__init__(self, bus, index, self.CUD_UUID, [
                             "read"], characteristic)
 
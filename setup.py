@@ -14,6 +14,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/Hmac512/DIMO_GATT",
     packages=setuptools.find_packages(exclude=['tests*']),
+    py_modules=['ecc_2'],
     entry_points={
         'console_scripts': [
             'dimo_gatt = gatt.gatt:main',
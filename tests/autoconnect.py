@@ -35,8 +35,8 @@ def extract_uuids(uuid_list):
 
 objects = manager.GetManagedObjects()
 
-all_devices = (str(path) for path, interfaces in objects.iteritems() if
-               "org.bluez.Device1" in interfaces.keys())
+all_devices = [str(path) for path, interfaces in objects.iteritems() if
+               "org.bluez.Device1" in interfaces.keys()]
 
 for path, interfaces in objects.iteritems():
     if "org.bluez.Adapter1" not in interfaces.keys():
@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+"""
+End-to-end benchmark of the GATT daemon against tests.mock_bluez.
+
+Starts a private dbus-daemon with the mock bluez on it, runs gatt.gatt in
+a subprocess against that bus and has simulated centrals issue ReadValue
+or WriteValue calls the way bluez forwards ATT requests, each central
+keeping one request in flight. A read of a value longer than one ATT
+packet is followed by offset reads like bluez does for long reads.
+
+Run from the repository root:
+
+    python -m tests.bench_e2e [-c CENTRALS] [-n REQUESTS] [-u UUID]
+                              [-o read|write] [-m MTU]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from optparse import OptionParser
+import os
+import subprocess
+import sys
+import time
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+
+from tests.mock_bluez import GATT_CHRC_IFACE, MockBluez, start_bus, stop_bus
+
+try:
+    from gi.repository import GLib
+except ImportError:
+    import gobject as GLib
+
+SIGNED_TOKEN_UUID = "ce878653-8c44-4326-84e5-3be6c0fa341f"
+
+DAEMON = "from gatt.gatt import main; main()"
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(len(ordered) * percent / 100.0))
+    return ordered[index]
+
+
+def start_daemon(address):
+    env = dict(os.environ)
+    env["DBUS_SYSTEM_BUS_ADDRESS"] = address
+    env.setdefault("DIMO_GATT_LOG_FILE", "")
+    env.setdefault("DIMO_GATT_LOG_LEVEL", "WARNING")
+    return subprocess.Popen([sys.executable, "-c", DAEMON], env=env)
+
+
+def wait_for(predicate, timeout):
+    """
+    Runs the mainloop until predicate() is true, polling it every 10 ms
+    """
+    loop = GLib.MainLoop()
+    deadline = time.monotonic() + timeout
+
+    def check():
+        if predicate() or time.monotonic() > deadline:
+            loop.quit()
+            return False
+        return True
+
+    if not predicate():
+        GLib.timeout_add(10, check)
+        loop.run()
+    return bool(predicate())
+
+
+class Central(object):
+    """
+    One simulated central issuing back to back requests
+    """
+
+    def __init__(self, bench, device):
+        self.bench = bench
+        self.device = device
+        self.remaining = bench.requests
+        self.start = None
+        self.chunks = []
+
+    def options(self, offset=0):
+        options = {"device": dbus.ObjectPath(self.device), "link": "LE",
+                   "offset": dbus.UInt16(offset)}
+        if self.bench.mtu:
+            options["mtu"] = dbus.UInt16(self.bench.mtu)
+        return options
+
+    def next(self):
+        if not self.remaining:
+            self.bench.finished(self)
+            return
+        self.remaining -= 1
+        self.start = time.monotonic()
+        self.chunks = []
+        if self.bench.operation == "write":
+            self.bench.chrc.WriteValue(
+                self.bench.payload, self.options(),
+                reply_handler=self.done, error_handler=self.failed)
+        else:
+            self.read(0)
+
+    def read(self, offset):
+        self.bench.chrc.ReadValue(
+            self.options(offset), byte_arrays=True,
+            reply_handler=self.read_done, error_handler=self.failed)
+
+    def read_done(self, value):
+        self.chunks.append(value)
+        # bluez forwards one ATT Read Blob per mtu - 1 bytes
+        chunk = self.bench.mtu - 1
+        if self.bench.mtu and len(value) > chunk:
+            self.read(sum(min(len(c), chunk) for c in self.chunks))
+        else:
+            self.done()
+
+    def done(self, *result):
+        self.bench.latencies.append(time.monotonic() - self.start)
+        self.next()
+
+    def failed(self, error):
+        self.bench.errors.append(error)
+        self.next()
+
+
+class Bench(object):
+    def __init__(self, chrc, operation, requests, mtu, payload):
+        self.chrc = chrc
+        self.operation = operation
+        self.requests = requests
+        self.mtu = mtu
+        self.payload = dbus.ByteArray(payload)
+        self.latencies = []
+        self.errors = []
+        self.running = 0
+        self.end = None
+
+    def run(self, devices):
+        centrals = [Central(self, device) for device in devices]
+        self.running = len(centrals)
+        start = time.monotonic()
+        for central in centrals:
+            central.next()
+        wait_for(lambda: not self.running, 600)
+        return (self.end or time.monotonic()) - start
+
+    def finished(self, central):
+        self.running -= 1
+        if not self.running:
+            self.end = time.monotonic()
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-c", "--centrals", action="store", type="int",
+                      dest="centrals", default=4)
+    parser.add_option("-n", "--requests", action="store", type="int",
+                      dest="requests", default=100,
+                      help="requests per central")
+    parser.add_option("-u", "--uuid", action="store", type="string",
+                      dest="uuid", default=SIGNED_TOKEN_UUID)
+    parser.add_option("-o", "--operation", action="store", type="choice",
+                      choices=["read", "write"], dest="operation",
+                      default="read")
+    parser.add_option("-m", "--mtu", action="store", type="int",
+                      dest="mtu", default=23, help="0 for unbounded reads")
+    parser.add_option("-p", "--payload", action="store", type="string",
+                      dest="payload", default="benchmark")
+    (options, args) = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus_process, address = start_bus()
+    daemon = None
+    try:
+        bus = dbus.bus.BusConnection(address)
+        mock = MockBluez(bus, options.centrals)
+        daemon = start_daemon(address)
+        if not wait_for(lambda: mock.find_characteristic(options.uuid) or
+                        daemon.poll() is not None, 60):
+            print("Daemon did not register %s" % options.uuid)
+            sys.exit(1)
+        if daemon.poll() is not None:
+            print("Daemon exited with %d" % daemon.returncode)
+            sys.exit(1)
+
+        owner, path = mock.find_characteristic(options.uuid)
+        chrc = dbus.Interface(bus.get_object(owner, path), GATT_CHRC_IFACE)
+        bench = Bench(chrc, options.operation, options.requests, options.mtu,
+                      options.payload.encode("utf-8"))
+        seconds = bench.run(sorted(mock.devices))
+
+        latencies = bench.latencies
+        print("%d centrals, %d %s requests to %s, mtu %d" % (
+            options.centrals, options.centrals * options.requests,
+            options.operation, options.uuid, options.mtu))
+        print("throughput: %10.1f req/s" % (len(latencies) / seconds))
+        print("p50:        %10.3f ms" % (percentile(latencies, 50) * 1e3))
+        print("p99:        %10.3f ms" % (percentile(latencies, 99) * 1e3))
+        print("errors:     %10d" % len(bench.errors))
+        for error in bench.errors[:3]:
+            print("  %s" % error)
+    finally:
+        if daemon is not None and daemon.poll() is None:
+            daemon.terminate()
+            daemon.wait()
+        stop_bus(bus_process)
+
+
+if __name__ == "__main__":
+    main()
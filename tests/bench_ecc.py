@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+"""
+Micro-benchmarks for ecc_2 scalar multiplication.
+
+Run from the repository root:
+
+    python -m tests.bench_ecc [-n ROUNDS]
+
+The field-arithmetic benchmark is re-run in a child process per backend
+(ECC_2_BACKEND=python / gmpy2), since ecc_2 picks its backend at import.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from optparse import OptionParser
+import os
+import random
+import subprocess
+import sys
+import timeit
+
+import ecc_2
+from ecc_2 import A, G, N, P, to_jacobian
+
+
+# The recursive double-and-add jacobian_multiply that ecc_2 used to ship,
+# with the point formulas it used, kept here unchanged as the baseline to
+# compare against.
+def original_jacobian_double(p):
+    if not p[1]:
+        return (0, 0, 0)
+    ysq = (p[1] ** 2) % P
+    S = (4 * p[0] * ysq) % P
+    M = (3 * p[0] ** 2 + A * p[2] ** 4) % P
+    nx = (M**2 - 2 * S) % P
+    ny = (M * (S - nx) - 8 * ysq ** 2) % P
+    nz = (2 * p[1] * p[2]) % P
+    return (nx, ny, nz)
+
+
+def original_jacobian_add(p, q):
+    if not p[1]:
+        return q
+    if not q[1]:
+        return p
+    U1 = (p[0] * q[2] ** 2) % P
+    U2 = (q[0] * p[2] ** 2) % P
+    S1 = (p[1] * q[2] ** 3) % P
+    S2 = (q[1] * p[2] ** 3) % P
+    if U1 == U2:
+        if S1 != S2:
+            return (0, 0, 1)
+        return original_jacobian_double(p)
+    H = U2 - U1
+    R = S2 - S1
+    H2 = (H * H) % P
+    H3 = (H * H2) % P
+    U1H2 = (U1 * H2) % P
+    nx = (R ** 2 - H3 - 2 * U1H2) % P
+    ny = (R * (U1H2 - nx) - S1 * H3) % P
+    nz = (H * p[2] * q[2]) % P
+    return (nx, ny, nz)
+
+
+def recursive_jacobian_multiply(a, n):
+    if a[1] == 0 or n == 0:
+        return (0, 0, 1)
+    if n == 1:
+        return a
+    if n < 0 or n >= N:
+        return recursive_jacobian_multiply(a, n % N)
+    if (n % 2) == 0:
+        return original_jacobian_double(recursive_jacobian_multiply(a, n // 2))
+    return original_jacobian_add(
+        original_jacobian_double(recursive_jacobian_multiply(a, n // 2)), a)
+
+
+def bench(label, func, args, rounds):
+    seconds = timeit.timeit(lambda: [func(*a) for a in args], number=rounds)
+    per_call = seconds / (rounds * len(args)) * 1e6
+    print("%-28s %10.1f us/call" % (label, per_call))
+    return per_call
+
+
+def bench_field(rounds):
+    rng = random.Random(1)
+    p = to_jacobian(ecc_2.multiply(G, rng.getrandbits(256)))
+    q = ecc_2.jacobian_double(p)
+    affine = ecc_2.batch_normalize([p])[0]
+    z = q[2]
+    ops = [
+        ("jacobian_double", lambda: ecc_2.jacobian_double(q)),
+        ("jacobian_add", lambda: ecc_2.jacobian_add(q, p)),
+        ("jacobian_add_mixed", lambda: ecc_2.jacobian_add_mixed(q, affine)),
+        ("inv", lambda: ecc_2.inv(z, ecc_2.P)),
+    ]
+    for label, func in ops:
+        seconds = timeit.timeit(func, number=rounds * 2000)
+        print("%-8s %-18s %12.0f ops/s" %
+              (ecc_2.BACKEND, label, rounds * 2000 / seconds))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", "--rounds", action="store", type="int",
+                      dest="rounds", default=5)
+    parser.add_option("-s", "--scalars", action="store", type="int",
+                      dest="scalars", default=50)
+    parser.add_option("--field", action="store_true", dest="field",
+                      default=False,
+                      help="only benchmark field ops on the current backend")
+    (options, args) = parser.parse_args()
+
+    if options.field:
+        requested = os.environ.get("ECC_2_BACKEND", ecc_2.BACKEND)
+        if requested != ecc_2.BACKEND:
+            print("%-8s not available, skipped" % requested)
+            return
+        bench_field(options.rounds)
+        return
+
+    rng = random.Random(0)
+    base = to_jacobian(ecc_2.multiply(G, rng.getrandbits(256)))
+    cases = [(base, rng.getrandbits(256)) for _ in range(options.scalars)]
+
+    # Property check: the recursive baseline, plain wNAF and the GLV split
+    # must agree on random and edge-case scalars before anything is timed
+    edges = [0, 1, 2, N - 1, N, N + 1, -1, 2**128, ecc_2.LAMBDA]
+    for a, n in cases + [(base, n) for n in edges]:
+        expected = ecc_2.from_jacobian(recursive_jacobian_multiply(a, n))
+        for glv in (False, True):
+            got = ecc_2.from_jacobian(ecc_2.jacobian_multiply(a, n, glv=glv))
+            if got != expected:
+                print("jacobian_multiply(glv=%s) mismatch for scalar %d" %
+                      (glv, n))
+                sys.exit(1)
+
+    old = bench("recursive double-and-add", recursive_jacobian_multiply,
+                cases, options.rounds)
+    new = bench("wNAF (w=%d)" % ecc_2.WNAF_WIDTH,
+                lambda a, n: ecc_2.jacobian_multiply(a, n, glv=False),
+                cases, options.rounds)
+    glv = bench("wNAF + GLV",
+                lambda a, n: ecc_2.jacobian_multiply(a, n, glv=True),
+                cases, options.rounds)
+    print("speedup: wNAF %.2fx, wNAF + GLV %.2fx" % (old / new, old / glv))
+
+    print("")
+    for backend in ("python", "gmpy2"):
+        env = dict(os.environ, ECC_2_BACKEND=backend)
+        subprocess.call([sys.executable, "-m", "tests.bench_ecc", "--field",
+                         "-n", str(options.rounds)], env=env)
+
+
+if __name__ == "__main__":
+    main()
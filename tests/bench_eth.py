@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+"""
+Compares the ecc_2 MessageSigner against the eth_account signing path.
+
+Run from the repository root:
+
+    python -m tests.bench_eth [-n ROUNDS]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from optparse import OptionParser
+import datetime
+import json
+import sys
+import timeit
+
+from gatt import eth
+
+
+def token():
+    return json.dumps({"timestamp": datetime.datetime.now().isoformat()},
+                      separators=(',', ':'))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", "--rounds", action="store", type="int",
+                      dest="rounds", default=200)
+    (options, args) = parser.parse_args()
+
+    msg = token()
+    if eth.get_signer().sign_message(msg) != eth.web3_sign_message(msg):
+        print("MessageSigner and eth_account disagree on %s" % msg)
+        sys.exit(1)
+
+    results = []
+    for label, func in (("eth_account", eth.web3_sign_message),
+                        ("MessageSigner", eth.get_signer().sign_message)):
+        seconds = timeit.timeit(lambda f=func: f(token()), number=options.rounds)
+        per_call = seconds / options.rounds * 1e3
+        results.append(per_call)
+        print("%-20s %8.3f ms/token" % (label, per_call))
+    print("speedup: %.2fx" % (results[0] / results[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+"""
+Measures Application.GetManagedObjects on a large GATT tree.
+
+The objects are not exported on a bus, so only dbus-python is needed.
+Run from the repository root:
+
+    python -m tests.bench_gatt [-c CHARACTERISTICS] [-n ROUNDS]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from optparse import OptionParser
+import logging
+import timeit
+
+from gatt.ble import Application, Characteristic, Descriptor, Service
+
+CHRC_UUID = "ce87%04x-8c44-4326-84e5-3be6c0fa341f"
+
+
+def build_app(characteristics, per_service=20):
+    app = Application(None)
+    service = None
+    for i in range(characteristics):
+        if i % per_service == 0:
+            service = Service(None, i // per_service,
+                              "58de7278-4723-48a9-8af5-c524617103bd", True)
+            app.add_service(service)
+        chrc = Characteristic(None, i, CHRC_UUID % i, ["read", "write"],
+                              service)
+        chrc.add_descriptor(Descriptor(None, 0, "2901", ["read"], chrc))
+        service.add_characteristic(chrc)
+    return app
+
+
+def bench(label, func, rounds):
+    seconds = timeit.timeit(func, number=rounds)
+    per_call = seconds / rounds * 1e6
+    print("%-32s %10.1f us/call" % (label, per_call))
+    return per_call
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-c", "--characteristics", action="store", type="int",
+                      dest="characteristics", default=300)
+    parser.add_option("-n", "--rounds", action="store", type="int",
+                      dest="rounds", default=200)
+    (options, args) = parser.parse_args()
+
+    logging.getLogger("gatt.ble").setLevel(logging.WARNING)
+    app = build_app(options.characteristics)
+    print("%d objects" % len(app.GetManagedObjects()))
+
+    def uncached():
+        app.invalidate()
+        return app.GetManagedObjects()
+
+    cold = bench("GetManagedObjects (rebuilt)", uncached, options.rounds)
+    warm = bench("GetManagedObjects (cached)", app.GetManagedObjects,
+                 options.rounds)
+    print("speedup: %.1fx" % (cold / warm))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Property tests for ecc_2 against a plain affine reference implementation
+"""
+
+import hashlib
+import random
+
+import pytest
+
+import ecc_2
+from ecc_2 import G, N, P
+
+INFINITY = None
+
+
+def ref_add(p, q):
+    if p is INFINITY:
+        return q
+    if q is INFINITY:
+        return p
+    if p[0] == q[0]:
+        if (p[1] + q[1]) % P == 0:
+            return INFINITY
+        m = 3 * p[0] * p[0] * pow(2 * p[1], P - 2, P)
+    else:
+        m = (q[1] - p[1]) * pow(q[0] - p[0], P - 2, P)
+    x = (m * m - p[0] - q[0]) % P
+    return (x, (m * (p[0] - x) - p[1]) % P)
+
+
+def ref_multiply(p, n):
+    result = INFINITY
+    n %= N
+    while n:
+        if n & 1:
+            result = ref_add(result, p)
+        p = ref_add(p, p)
+        n >>= 1
+    return result
+
+
+def affine(point):
+    x, y = ecc_2.from_jacobian(point)
+    return INFINITY if (x, y) == (0, 0) else (x, y)
+
+
+RNG = random.Random(5)
+BASE = ref_multiply(G, RNG.getrandbits(256))
+SCALARS = [RNG.getrandbits(256) for _ in range(8)] + [
+    0, 1, 2, 3, N - 1, N, N + 1, -1, -N + 5, 2**128, 2**255,
+    ecc_2.LAMBDA, ecc_2.LAMBDA + 1, N - ecc_2.LAMBDA]
+
+
+@pytest.mark.parametrize("glv", [False, True])
+@pytest.mark.parametrize("n", SCALARS)
+def test_multiply_matches_reference(n, glv):
+    got = affine(ecc_2.jacobian_multiply(ecc_2.to_jacobian(BASE), n, glv=glv))
+    assert got == ref_multiply(BASE, n)
+
+
+@pytest.mark.parametrize("glv", [False, True])
+def test_multi_multiply_matches_reference(glv):
+    rng = random.Random(7)
+    other = ref_multiply(G, rng.getrandbits(256))
+    for _ in range(5):
+        g, a, b = (rng.getrandbits(256) for _ in range(3))
+        pairs = [(ecc_2.to_jacobian(BASE), a), (ecc_2.to_jacobian(other), b)]
+        expected = ref_add(ref_add(ref_multiply(G, g), ref_multiply(BASE, a)),
+                           ref_multiply(other, b))
+        assert affine(ecc_2.jacobian_multi_multiply(pairs, g, glv=glv)) == \
+            expected
+
+
+def test_privtopub_matches_reference():
+    for i in range(5):
+        priv = hashlib.sha256(b"priv %d" % i).digest()
+        assert ecc_2.privtopub(priv) == \
+            ref_multiply(G, ecc_2.bytes_to_int(priv))
+
+
+def sign_cases(count):
+    for i in range(count):
+        priv = hashlib.sha256(b"key %d" % i).digest()
+        msghash = hashlib.sha256(b"message %d" % i).digest()
+        yield priv, msghash, ecc_2.ecdsa_raw_sign(msghash, priv)
+
+
+def test_sign_verifies_with_reference():
+    for priv, msghash, (v, r, s) in sign_cases(10):
+        assert v in (27, 28)
+        assert 0 < s <= N // 2
+        public = ref_multiply(G, ecc_2.bytes_to_int(priv))
+        w = pow(s, N - 2, N)
+        z = ecc_2.bytes_to_int(msghash)
+        point = ref_add(ref_multiply(G, z * w), ref_multiply(public, r * w))
+        assert point[0] % N == r
+
+
+def test_sign_recover_round_trip():
+    for priv, msghash, vrs in sign_cases(10):
+        assert ecc_2.ecdsa_raw_recover(msghash, vrs) == ecc_2.privtopub(priv)
+
+
+def test_recover_batch_matches_single_and_reports_errors():
+    cases = list(sign_cases(6))
+    items = [(msghash, vrs) for _, msghash, vrs in cases]
+    v, r, s = items[0][1]
+    not_on_curve = next(x for x in range(1, 100)
+                        if pow(x ** 3 + 7, (P - 1) // 2, P) != 1)
+    bad = [
+        (items[0][0], (26, r, s)),
+        (items[0][0], (v, not_on_curve, s)),
+        (items[0][0], (v, r, 0)),
+        (None, (v, r, s)),
+    ]
+    batch = items[:3] + bad + items[3:]
+
+    results = ecc_2.ecdsa_raw_recover_batch(batch)
+
+    assert len(results) == len(batch)
+    good = results[:3] + results[3 + len(bad):]
+    for (priv, msghash, vrs), (public, error) in zip(cases, good):
+        assert error is None
+        assert public == ecc_2.ecdsa_raw_recover(msghash, vrs)
+        assert public == ecc_2.privtopub(priv)
+    for public, error in results[3:3 + len(bad)]:
+        assert public is None
+        assert isinstance(error, (TypeError, ValueError))
+
+
+def test_recover_batch_uses_constant_inversions(monkeypatch):
+    items = [(msghash, vrs) for _, msghash, vrs in sign_cases(10)]
+    ecc_2.ecdsa_raw_recover_batch(items[:1])
+    calls = []
+    inv = ecc_2.inv
+
+    def counting_inv(a, n):
+        calls.append(n)
+        return inv(a, n)
+
+    monkeypatch.setattr(ecc_2, "inv", counting_inv)
+    ecc_2.ecdsa_raw_recover_batch(items)
+    assert len(calls) == 3
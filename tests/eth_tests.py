@@ -0,0 +1,63 @@
+"""
+Tests for the ecc_2 based EIP-191 signing in gatt.eth
+"""
+
+import pytest
+
+import ecc_2
+
+eth = pytest.importorskip("gatt.eth")
+
+KEY_ONE = (1).to_bytes(32, "big")
+KEY_ONE_ADDRESS = "0x7E5F4552091A69125d5DfCb7b8C2659029395Bdf"
+
+
+@pytest.fixture
+def signer(monkeypatch):
+    signer = eth.MessageSigner(KEY_ONE)
+    monkeypatch.setattr(eth, "_signer", signer)
+    return signer
+
+
+def test_eip191_hash():
+    digest = "50b2c43fd39106bafbba0da34fc430e1f91e3c96ea2acee2bc34119f92b37750"
+    assert eth.eip191_hash("hello").hex() == digest
+    assert eth.eip191_hash(b"hello").hex() == digest
+
+
+def test_public_key_to_address():
+    assert eth.public_key_to_address(ecc_2.G) == KEY_ONE_ADDRESS
+
+
+def test_message_signer_address():
+    signer = eth.MessageSigner(KEY_ONE)
+    assert signer.public_key == ecc_2.G
+    assert signer.address == KEY_ONE_ADDRESS
+
+
+def test_sign_message_raw_recovers_signer(signer):
+    for msg in ("hello", "", '{"timestamp": 1}'):
+        signature = eth.sign_message_raw(msg)
+        assert len(signature) == 65
+        r = ecc_2.bytes_to_int(signature[:32])
+        s = ecc_2.bytes_to_int(signature[32:64])
+        vrs = (signature[64], r, s)
+        public_key = ecc_2.ecdsa_raw_recover(eth.eip191_hash(msg), vrs)
+        assert eth.public_key_to_address(public_key) == KEY_ONE_ADDRESS
+        assert eth.sign_message(msg) == "0x" + signature.hex()
+
+
+def test_signer_is_built_on_first_use(monkeypatch):
+    loads = []
+
+    def load_private_key():
+        loads.append(1)
+        return KEY_ONE
+
+    monkeypatch.setattr(eth, "_signer", None)
+    monkeypatch.setattr(eth, "load_private_key", load_private_key)
+    assert loads == []
+    eth.sign_message("hello")
+    eth.sign_message("again")
+    assert loads == [1]
+    assert eth.get_signer().address == KEY_ONE_ADDRESS
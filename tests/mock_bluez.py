@@ -0,0 +1,360 @@
+#!/usr/bin/python3
+"""
+Headless stand-in for the parts of bluez that gatt.gatt talks to, served on
+a private dbus-daemon so the daemon runs without an adapter or system bus:
+the org.bluez ObjectManager, an adapter with GattManager1 and
+LEAdvertisingManager1, AgentManager1 and a few Device1 objects.
+
+Run from the repository root:
+
+    python -m tests.mock_bluez [-d DEVICES]
+
+and start the daemon against the printed address:
+
+    DBUS_SYSTEM_BUS_ADDRESS=<address> python -m gatt.gatt
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from optparse import OptionParser
+import os
+import shutil
+import subprocess
+import tempfile
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+import dbus.service
+
+try:
+    from gi.repository import GLib
+except ImportError:
+    import gobject as GLib
+
+BUS_NAME = "org.bluez"
+ADAPTER_PATH = "/org/bluez/hci0"
+
+DBUS_OM_IFACE = "org.freedesktop.DBus.ObjectManager"
+DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
+ADAPTER_IFACE = "org.bluez.Adapter1"
+DEVICE_IFACE = "org.bluez.Device1"
+AGENT_MANAGER_IFACE = "org.bluez.AgentManager1"
+GATT_MANAGER_IFACE = "org.bluez.GattManager1"
+GATT_CHRC_IFACE = "org.bluez.GattCharacteristic1"
+LE_ADVERTISING_MANAGER_IFACE = "org.bluez.LEAdvertisingManager1"
+LE_ADVERTISEMENT_IFACE = "org.bluez.LEAdvertisement1"
+
+BUS_CONFIG = """<!DOCTYPE busconfig PUBLIC
+ "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>session</type>
+  <listen>unix:dir=%s</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow send_destination="*" eavesdrop="true"/>
+    <allow eavesdrop="true"/>
+    <allow own="*"/>
+  </policy>
+</busconfig>
+"""
+
+
+class DoesNotExistException(dbus.exceptions.DBusException):
+    _dbus_error_name = "org.bluez.Error.DoesNotExist"
+
+
+class InvalidArgsException(dbus.exceptions.DBusException):
+    _dbus_error_name = "org.freedesktop.DBus.Error.InvalidArgs"
+
+
+class FailedException(dbus.exceptions.DBusException):
+    _dbus_error_name = "org.bluez.Error.Failed"
+
+
+def start_bus():
+    """
+    Starts a private dbus-daemon and returns (process, address)
+    """
+    directory = tempfile.mkdtemp(prefix="mock-bluez-")
+    config = os.path.join(directory, "bus.conf")
+    with open(config, "w") as config_file:
+        config_file.write(BUS_CONFIG % directory)
+    process = subprocess.Popen(
+        ["dbus-daemon", "--config-file=" + config, "--nofork",
+         "--print-address"], stdout=subprocess.PIPE)
+    address = process.stdout.readline().decode("utf-8").strip()
+    process.directory = directory
+    return process, address
+
+
+def stop_bus(process):
+    process.terminate()
+    process.wait()
+    shutil.rmtree(process.directory, ignore_errors=True)
+
+
+class PropertiesObject(dbus.service.Object):
+    """
+    Object with a single bluez interface whose properties live in a dict
+    """
+
+    IFACE = None
+
+    def __init__(self, bus, path, properties):
+        self.path = path
+        self.properties = properties
+        dbus.service.Object.__init__(self, bus, path)
+
+    def get_properties(self):
+        return {self.IFACE: self.properties}
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+        self.PropertiesChanged(self.IFACE, {name: value}, [])
+
+    @dbus.service.method(DBUS_PROP_IFACE, in_signature="ss", out_signature="v")
+    def Get(self, interface, name):
+        if interface != self.IFACE or name not in self.properties:
+            raise InvalidArgsException()
+        return self.properties[name]
+
+    @dbus.service.method(DBUS_PROP_IFACE, in_signature="s", out_signature="a{sv}")
+    def GetAll(self, interface):
+        if interface != self.IFACE:
+            raise InvalidArgsException()
+        return self.properties
+
+    @dbus.service.method(DBUS_PROP_IFACE, in_signature="ssv")
+    def Set(self, interface, name, value):
+        if interface != self.IFACE or name not in self.properties:
+            raise InvalidArgsException()
+        self.set_property(name, value)
+
+    @dbus.service.signal(DBUS_PROP_IFACE, signature="sa{sv}as")
+    def PropertiesChanged(self, interface, changed, invalidated):
+        pass
+
+
+class Device(PropertiesObject):
+    """
+    Connect() answers after connect_delay_ms, failing unless reachable
+    """
+
+    IFACE = DEVICE_IFACE
+
+    reachable = True
+    connect_delay_ms = 0
+
+    def __init__(self, bus, adapter, address, connected=False):
+        path = "%s/dev_%s" % (adapter.path, address.replace(":", "_"))
+        PropertiesObject.__init__(self, bus, path, {
+            "Address": address,
+            "AddressType": "random",
+            "Alias": address,
+            "Adapter": dbus.ObjectPath(adapter.path),
+            "Paired": dbus.Boolean(True),
+            "Trusted": dbus.Boolean(True),
+            "Connected": dbus.Boolean(connected),
+            "RSSI": dbus.Int16(-60),
+            "UUIDs": dbus.Array([], signature="s"),
+        })
+        self.connects = 0
+        self.disconnects = 0
+
+    @dbus.service.method(DEVICE_IFACE,
+                         async_callbacks=("reply_handler", "error_handler"))
+    def Connect(self, reply_handler=None, error_handler=None):
+        self.connects += 1
+
+        def connected():
+            if not self.reachable:
+                error_handler(FailedException("Page Timeout"))
+            else:
+                self.set_property("Connected", dbus.Boolean(True))
+                reply_handler()
+            return False
+
+        GLib.timeout_add(self.connect_delay_ms, connected)
+
+    @dbus.service.method(DEVICE_IFACE)
+    def Disconnect(self):
+        self.disconnects += 1
+        self.set_property("Connected", dbus.Boolean(False))
+
+
+class Adapter(PropertiesObject):
+    """
+    hci0 with GattManager1 and LEAdvertisingManager1. Registered objects
+    are fetched from the registering connection like bluez does.
+    """
+
+    IFACE = ADAPTER_IFACE
+
+    def __init__(self, bus, path=ADAPTER_PATH):
+        PropertiesObject.__init__(self, bus, path, {
+            "Address": "00:00:5E:00:53:00",
+            "Name": "mock",
+            "Alias": "mock",
+            "Powered": dbus.Boolean(False),
+            "Pairable": dbus.Boolean(False),
+            "Discoverable": dbus.Boolean(False),
+        })
+        self.bus = bus
+        # (sender, path) -> GetManagedObjects result / advertisement props
+        self.applications = {}
+        self.advertisements = {}
+
+    def get_properties(self):
+        return {
+            ADAPTER_IFACE: self.properties,
+            GATT_MANAGER_IFACE: {},
+            LE_ADVERTISING_MANAGER_IFACE: {},
+        }
+
+    @dbus.service.method(GATT_MANAGER_IFACE, in_signature="oa{sv}",
+                         sender_keyword="sender",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def RegisterApplication(self, path, options, sender=None,
+                            reply_handler=None, error_handler=None):
+        def registered(objects):
+            self.applications[(sender, path)] = objects
+            reply_handler()
+
+        om = dbus.Interface(self.bus.get_object(sender, path), DBUS_OM_IFACE)
+        om.GetManagedObjects(reply_handler=registered,
+                             error_handler=error_handler)
+
+    @dbus.service.method(GATT_MANAGER_IFACE, in_signature="o",
+                         sender_keyword="sender")
+    def UnregisterApplication(self, path, sender=None):
+        if self.applications.pop((sender, path), None) is None:
+            raise DoesNotExistException()
+
+    @dbus.service.method(LE_ADVERTISING_MANAGER_IFACE, in_signature="oa{sv}",
+                         sender_keyword="sender",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def RegisterAdvertisement(self, path, options, sender=None,
+                              reply_handler=None, error_handler=None):
+        def registered(properties):
+            self.advertisements[(sender, path)] = properties
+            reply_handler()
+
+        props = dbus.Interface(self.bus.get_object(sender, path),
+                               DBUS_PROP_IFACE)
+        props.GetAll(LE_ADVERTISEMENT_IFACE, reply_handler=registered,
+                     error_handler=error_handler)
+
+    @dbus.service.method(LE_ADVERTISING_MANAGER_IFACE, in_signature="o",
+                         sender_keyword="sender")
+    def UnregisterAdvertisement(self, path, sender=None):
+        if self.advertisements.pop((sender, path), None) is None:
+            raise DoesNotExistException()
+
+
+class AgentManager(dbus.service.Object):
+    def __init__(self, bus, path="/org/bluez"):
+        self.agents = {}
+        self.default_agent = None
+        dbus.service.Object.__init__(self, bus, path)
+
+    @dbus.service.method(AGENT_MANAGER_IFACE, in_signature="os",
+                         sender_keyword="sender")
+    def RegisterAgent(self, path, capability, sender=None):
+        self.agents[(sender, path)] = capability
+
+    @dbus.service.method(AGENT_MANAGER_IFACE, in_signature="o",
+                         sender_keyword="sender")
+    def UnregisterAgent(self, path, sender=None):
+        if self.agents.pop((sender, path), None) is None:
+            raise DoesNotExistException()
+
+    @dbus.service.method(AGENT_MANAGER_IFACE, in_signature="o",
+                         sender_keyword="sender")
+    def RequestDefaultAgent(self, path, sender=None):
+        if (sender, path) not in self.agents:
+            raise DoesNotExistException()
+        self.default_agent = (sender, path)
+
+
+class MockBluez(dbus.service.Object):
+    """
+    The org.bluez ObjectManager at "/", owning the adapter, agent manager
+    and devices. Must be created after the GLib main loop is set as the
+    dbus default.
+    """
+
+    def __init__(self, bus, devices=4):
+        self.bus = bus
+        self.name = dbus.service.BusName(BUS_NAME, bus)
+        dbus.service.Object.__init__(self, bus, "/")
+        self.adapter = Adapter(bus)
+        self.agent_manager = AgentManager(bus)
+        self.devices = {}
+        for i in range(devices):
+            self.add_device("02:00:00:00:%02X:%02X" % (i >> 8, i & 0xff))
+
+    def add_device(self, address, connected=False):
+        device = Device(self.bus, self.adapter, address, connected)
+        self.devices[device.path] = device
+        self.InterfacesAdded(device.path, device.get_properties())
+        return device
+
+    def remove_device(self, path):
+        device = self.devices.pop(path)
+        device.remove_from_connection()
+        self.InterfacesRemoved(path, [DEVICE_IFACE])
+
+    def find_characteristic(self, uuid):
+        """
+        Returns (bus name, path) of a characteristic of a registered
+        application, or None
+        """
+        for (sender, _path), objects in self.applications().items():
+            for obj_path, interfaces in objects.items():
+                chrc = interfaces.get(GATT_CHRC_IFACE)
+                if chrc is not None and str(chrc["UUID"]) == uuid:
+                    return sender, obj_path
+        return None
+
+    def applications(self):
+        return self.adapter.applications
+
+    @dbus.service.method(DBUS_OM_IFACE, out_signature="a{oa{sa{sv}}}")
+    def GetManagedObjects(self):
+        objects = {self.adapter.path: self.adapter.get_properties()}
+        for path, device in self.devices.items():
+            objects[path] = device.get_properties()
+        return objects
+
+    @dbus.service.signal(DBUS_OM_IFACE, signature="oa{sa{sv}}")
+    def InterfacesAdded(self, path, interfaces):
+        pass
+
+    @dbus.service.signal(DBUS_OM_IFACE, signature="oas")
+    def InterfacesRemoved(self, path, interfaces):
+        pass
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-d", "--devices", action="store", type="int",
+                      dest="devices", default=4)
+    (options, args) = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    process, address = start_bus()
+    try:
+        bus = dbus.bus.BusConnection(address)
+        mock = MockBluez(bus, options.devices)  # noqa: F841
+        print(address)
+        GLib.MainLoop().run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_bus(process)
+
+
+if __name__ == "__main__":
+    main()
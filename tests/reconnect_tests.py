@@ -0,0 +1,234 @@
+"""
+Tests for gatt.autoconnect.ReconnectScheduler with a fake registry, bus and
+GLib timer source
+"""
+
+import pytest
+
+pytest.importorskip("dbus")
+
+from gatt import autoconnect  # noqa: E402
+from gatt.autoconnect import ReconnectScheduler  # noqa: E402
+
+
+class FakeGLib(object):
+    def __init__(self):
+        self.timers = {}
+        self._next_id = 0
+
+    def timeout_add(self, ms, func, *args):
+        self._next_id += 1
+        self.timers[self._next_id] = (ms, func, args)
+        return self._next_id
+
+    def source_remove(self, source):
+        del self.timers[source]
+
+    def delays(self):
+        return [ms for ms, _, _ in self.timers.values()]
+
+    def fire(self):
+        timers, self.timers = self.timers, {}
+        for _, func, args in timers.values():
+            func(*args)
+
+
+class FakeRegistry(object):
+    def __init__(self, paths):
+        self.devices = dict((path, {"Connected": False}) for path in paths)
+        self.trusted = set(paths)
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def get(self, path):
+        return self.devices.get(path)
+
+    def trusted_devices(self):
+        return sorted(self.trusted)
+
+    def change(self, path, **changed):
+        if changed.get("Trusted") is False:
+            self.trusted.discard(path)
+        self.devices[path].update(changed)
+        for listener in list(self.listeners):
+            listener(path, self.devices[path], changed)
+
+
+class FakeDevice(object):
+    def __init__(self, bus, path):
+        self.bus = bus
+        self.path = path
+
+    def Connect(self, reply_handler, error_handler, timeout):
+        self.bus.connects.append(self.path)
+        self.bus.pending[self.path] = (reply_handler, error_handler)
+
+
+class FakeBus(object):
+    def __init__(self):
+        self.connects = []
+        self.pending = {}
+
+    def get_object(self, name, path):
+        return FakeDevice(self, path)
+
+    def fail(self, path):
+        self.pending.pop(path)[1](Exception("Page Timeout"))
+
+    def succeed(self, path, registry):
+        registry.change(path, Connected=True)
+        self.pending.pop(path)[0]()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(autoconnect.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def glib(monkeypatch):
+    fake = FakeGLib()
+    monkeypatch.setattr(autoconnect, "GLib", fake)
+    monkeypatch.setattr(autoconnect.dbus, "Interface", lambda obj, iface: obj)
+    return fake
+
+
+def scheduler(paths, **kwargs):
+    registry = FakeRegistry(paths)
+    bus = FakeBus()
+    kwargs.setdefault("initial_backoff", 2.0)
+    return ReconnectScheduler(bus, registry, **kwargs), registry, bus
+
+
+def test_full_slots_do_not_spin(clock, glib):
+    sched, registry, bus = scheduler(["/a", "/b"], max_in_flight=1)
+    sched.start()
+    glib.fire()
+    assert bus.connects == ["/a"]
+
+    bus.fail("/a")
+    glib.fire()
+    assert bus.connects == ["/a", "/b"]
+
+    # /a is due again while /b still holds the only slot
+    clock[0] += 10
+    assert glib.delays() == []
+    sched._schedule(0)
+    glib.fire()
+    assert glib.delays() == []
+    assert bus.connects == ["/a", "/b"]
+
+    bus.succeed("/b", registry)
+    glib.fire()
+    assert bus.connects == ["/a", "/b", "/a"]
+
+
+def test_backoff_waits_for_next_attempt(clock, glib):
+    sched, registry, bus = scheduler(["/a"], max_backoff=2.0)
+    sched.start()
+    glib.fire()
+    bus.fail("/a")
+    glib.fire()
+    delays = glib.delays()
+    assert len(delays) == 1 and 1000 <= delays[0] <= 2000
+
+    clock[0] += delays[0] / 1000.0
+    glib.fire()
+    assert bus.connects == ["/a", "/a"]
+
+
+def test_untrusted_device_is_forgotten(clock, glib):
+    sched, registry, bus = scheduler(["/a"])
+    sched.start()
+    glib.fire()
+    bus.fail("/a")
+    glib.fire()
+    assert "/a" in sched._backoff
+
+    registry.change("/a", Trusted=False)
+    assert "/a" not in sched._backoff
+    clock[0] += 10
+    glib.fire()
+    assert glib.delays() == []
+    assert bus.connects == ["/a"]
+
+
+def test_held_device_is_not_reconnected_after_disconnect(clock, glib):
+    sched, registry, bus = scheduler(["/a"])
+    sched.start()
+    glib.fire()
+    bus.succeed("/a", registry)
+    glib.fire()
+
+    sched.hold("/a", 60.0)
+    registry.change("/a", Connected=False)
+    registry.change("/a", RSSI=-40)
+    glib.fire()
+    assert bus.connects == ["/a"]
+    assert glib.delays() == [60000]
+
+    clock[0] += 60
+    glib.fire()
+    assert bus.connects == ["/a", "/a"]
+
+
+def drop(registry, glib, path):
+    registry.change(path, Connected=False)
+    glib.fire()
+    return glib.delays()[0] / 1000.0
+
+
+def test_disconnect_waits_at_least_initial_backoff(clock, glib):
+    sched, registry, bus = scheduler(["/a"], min_uptime=10.0)
+    sched.start()
+    glib.fire()
+    bus.succeed("/a", registry)
+    glib.fire()
+
+    clock[0] += 10
+    delay = drop(registry, glib, "/a")
+    assert 2.0 <= delay <= 4.0
+    registry.change("/a", RSSI=-40)
+    glib.fire()
+    assert bus.connects == ["/a"]
+
+    clock[0] += delay
+    glib.fire()
+    assert bus.connects == ["/a", "/a"]
+
+
+def test_flapping_device_backs_off_until_stable(clock, glib):
+    sched, registry, bus = scheduler(["/a"], min_uptime=10.0,
+                                     max_backoff=1000.0)
+    sched.start()
+    glib.fire()
+    delays = []
+    for _ in range(4):
+        bus.succeed("/a", registry)
+        glib.fire()
+        delays.append(drop(registry, glib, "/a"))
+        clock[0] += delays[-1]
+        glib.fire()
+    assert [2.0 * 2 ** i <= d <= 4.0 * 2 ** i
+            for i, d in enumerate(delays)] == [True] * 4
+
+    # a link that stays up for min_uptime starts over
+    bus.succeed("/a", registry)
+    clock[0] += 10
+    assert 2.0 <= drop(registry, glib, "/a") <= 4.0
+
+
+def test_devices_connected_before_start_count_as_stable(clock, glib):
+    sched, registry, bus = scheduler(["/a"])
+    registry.devices["/a"]["Connected"] = True
+    sched.start()
+    glib.fire()
+    assert bus.connects == []
+    assert 2.0 <= drop(registry, glib, "/a") <= 4.0
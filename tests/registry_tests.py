@@ -0,0 +1,145 @@
+"""
+Tests for gatt.autoconnect.DeviceRegistry driven by fake bluez signals
+"""
+
+import pytest
+
+pytest.importorskip("dbus")
+
+from gatt import autoconnect  # noqa: E402
+from gatt.autoconnect import (ADAPTER_IFACE, DEVICE_IFACE,  # noqa: E402
+                              DeviceRegistry)
+
+HCI0 = "/org/bluez/hci0"
+HCI1 = "/org/bluez/hci1"
+ADDRESS = "02:00:00:00:00:01"
+
+
+def device(adapter, address, **properties):
+    path = "%s/dev_%s" % (adapter, address.replace(":", "_"))
+    properties.setdefault("Trusted", False)
+    properties.setdefault("Paired", False)
+    properties.update(Address=address, Adapter=adapter)
+    return path, {DEVICE_IFACE: properties}
+
+
+class FakeReceiver(object):
+    def __init__(self, receivers):
+        self.receivers = receivers
+
+    def remove(self):
+        self.receivers.remove(self)
+
+
+class FakeBus(object):
+    def __init__(self, objects):
+        self.objects = objects
+        self.receivers = []
+
+    def add_signal_receiver(self, handler, **kwargs):
+        receiver = FakeReceiver(self.receivers)
+        self.receivers.append(receiver)
+        return receiver
+
+    def get_object(self, name, path):
+        return self
+
+    def GetManagedObjects(self):
+        return self.objects
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(autoconnect.dbus, "Interface", lambda obj, iface: obj)
+    objects = dict([
+        (HCI0, {ADAPTER_IFACE: {"Address": "00:00:5E:00:53:00"}}),
+        (HCI1, {ADAPTER_IFACE: {"Address": "00:00:5E:00:53:01"}}),
+        device(HCI0, ADDRESS, Trusted=True),
+        device(HCI1, ADDRESS),
+    ])
+    registry = DeviceRegistry(FakeBus(objects))
+    registry.events = []
+    registry.add_listener(lambda path, properties, changed:
+                          registry.events.append((path, changed)))
+    registry.start()
+    return registry
+
+
+def test_load_indexes_adapters_and_devices(registry):
+    on_hci0, _ = device(HCI0, ADDRESS)
+    on_hci1, _ = device(HCI1, ADDRESS)
+    assert sorted(registry.adapters) == [HCI0, HCI1]
+    assert registry.devices_on(HCI0) == [on_hci0]
+    assert registry.devices_on(HCI1) == [on_hci1]
+    assert registry.find(ADDRESS.lower(), HCI0) == on_hci0
+    assert registry.find(ADDRESS, HCI1) == on_hci1
+    assert registry.find(ADDRESS) in (on_hci0, on_hci1)
+    assert registry.find("02:00:00:00:00:09") is None
+    assert registry.get(on_hci0)["Trusted"]
+    assert len(registry.events) == 2
+    assert len(registry.bus.receivers) == 3
+
+
+def test_trusted_follows_trusted_and_paired(registry):
+    on_hci0, _ = device(HCI0, ADDRESS)
+    on_hci1, _ = device(HCI1, ADDRESS)
+    assert registry.trusted_devices() == [on_hci0]
+
+    registry._properties_changed(DEVICE_IFACE, {"Paired": True}, [],
+                                 path=on_hci1)
+    assert sorted(registry.trusted_devices()) == [on_hci0, on_hci1]
+    assert registry.trusted_devices(HCI1) == [on_hci1]
+
+    registry._properties_changed(DEVICE_IFACE, {"Trusted": False}, [],
+                                 path=on_hci0)
+    assert registry.trusted_devices() == [on_hci1]
+    registry._properties_changed(DEVICE_IFACE, {}, ["Paired"], path=on_hci1)
+    assert registry.trusted_devices() == []
+    assert "Paired" not in registry.get(on_hci1)
+    assert registry.events[-1] == (on_hci1, {})
+
+
+def test_changes_to_unknown_devices_are_ignored(registry):
+    registry._properties_changed(DEVICE_IFACE, {"Trusted": True}, [],
+                                 path=HCI0 + "/dev_unknown")
+    assert registry.get(HCI0 + "/dev_unknown") is None
+    assert len(registry.events) == 2
+
+
+def test_added_device_is_indexed(registry):
+    path, interfaces = device(HCI1, "02:00:00:00:00:02", Paired=True)
+    registry._interfaces_added(path, interfaces)
+    assert registry.find("02:00:00:00:00:02") == path
+    assert path in registry.devices_on(HCI1)
+    assert path in registry.trusted_devices(HCI1)
+    assert registry.events[-1][0] == path
+
+
+def test_removal_cleans_up_every_index(registry):
+    on_hci0, _ = device(HCI0, ADDRESS)
+    on_hci1, _ = device(HCI1, ADDRESS)
+
+    registry._interfaces_removed(on_hci0, [DEVICE_IFACE])
+    assert registry.get(on_hci0) is None
+    assert registry.devices_on(HCI0) == []
+    assert registry.trusted_devices() == []
+    assert registry.find(ADDRESS, HCI0) is None
+    assert registry.find(ADDRESS) == on_hci1
+    assert registry.events[-1] == (on_hci0, {})
+
+    registry._interfaces_removed(on_hci1, [DEVICE_IFACE])
+    assert registry.find(ADDRESS) is None
+    assert ADDRESS not in registry._by_address
+
+    registry._interfaces_removed(HCI1, [ADAPTER_IFACE])
+    assert sorted(registry.adapters) == [HCI0]
+    assert HCI1 not in registry._by_adapter
+
+    events = len(registry.events)
+    registry._interfaces_removed(on_hci1, [DEVICE_IFACE])
+    assert len(registry.events) == events
+
+
+def test_stop_removes_signal_receivers(registry):
+    registry.stop()
+    assert registry.bus.receivers == []
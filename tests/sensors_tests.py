@@ -0,0 +1,62 @@
+"""
+Tests for gatt.sensors.TemperatureSampler against a fake sysfs tree
+"""
+
+import subprocess
+
+from gatt import sensors
+from gatt.sensors import TemperatureSampler, format_temp
+
+
+def write_zone(root, name, content):
+    zone = root / name
+    zone.mkdir()
+    (zone / "temp").write_text(content)
+
+
+def sampler(root, **kwargs):
+    return TemperatureSampler(
+        source_glob=str(root / "thermal_zone*" / "temp"), **kwargs)
+
+
+def test_reads_first_readable_zone_in_order(tmp_path):
+    write_zone(tmp_path, "thermal_zone1", "61000\n")
+    write_zone(tmp_path, "thermal_zone0", "not a number\n")
+    write_zone(tmp_path, "thermal_zone2", "48500\n")
+    (tmp_path / "thermal_zone00").mkdir()
+
+    assert sampler(tmp_path).read_sysfs() == 61.0
+
+
+def test_no_zone_returns_none(tmp_path):
+    assert sampler(tmp_path).read_sysfs() is None
+
+
+def test_latest_serves_cached_sample_until_ttl(tmp_path, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(sensors.time, "monotonic", lambda: now[0])
+    write_zone(tmp_path, "thermal_zone0", "50000\n")
+    temp = sampler(tmp_path, ttl=5.0)
+
+    assert temp.latest() == 50.0
+    (tmp_path / "thermal_zone0" / "temp").write_text("70000\n")
+    now[0] += 4.9
+    assert temp.latest() == 50.0
+    now[0] += 0.1
+    assert temp.latest() == 70.0
+    assert len(temp.samples) == 2
+
+
+def test_falls_back_to_vcgencmd(tmp_path, monkeypatch):
+    calls = []
+
+    def check_output(args):
+        calls.append(args)
+        return b"temp=47.2'C\n"
+
+    monkeypatch.setattr(subprocess, "check_output", check_output)
+    temp = sampler(tmp_path)
+
+    assert temp.latest() == 47.2
+    assert calls == [["vcgencmd", "measure_temp"]]
+    assert format_temp(temp.latest()) == "temp=47.2'C"
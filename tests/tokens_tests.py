@@ -0,0 +1,76 @@
+"""
+Tests for gatt.tokens.TokenPool with a fake clock
+"""
+
+import itertools
+
+import pytest
+
+from gatt import tokens
+from gatt.tokens import TokenPool
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(tokens.time, "monotonic", lambda: now[0])
+    return now
+
+
+def pool(**kwargs):
+    counter = itertools.count()
+    return TokenPool(lambda: next(counter), **kwargs)
+
+
+def test_refill_stops_at_size(clock):
+    tokens_pool = pool(granularity=1.0, ttl=5.0, size=4)
+    tokens_pool._refill()
+    assert [token for _, token in tokens_pool._tokens] == [0, 1, 2, 3]
+
+    tokens_pool._refill()
+    assert len(tokens_pool._tokens) == 4
+
+    # one fresh token per granularity, the oldest makes room
+    clock[0] += 1.0
+    tokens_pool._refill()
+    assert [token for _, token in tokens_pool._tokens] == [1, 2, 3, 4]
+
+
+def test_pop_serves_newest_first(clock):
+    tokens_pool = pool(size=3)
+    tokens_pool._refill()
+    assert [tokens_pool.pop() for _ in range(3)] == [2, 1, 0]
+
+
+def test_pop_signs_inline_when_empty(clock):
+    tokens_pool = pool(size=2)
+    assert tokens_pool.pop() == 0
+    tokens_pool._refill()
+    assert [tokens_pool.pop() for _ in range(3)] == [2, 1, 3]
+
+
+def test_expired_tokens_are_not_served(clock):
+    tokens_pool = pool(granularity=1.0, ttl=5.0, size=2)
+    tokens_pool._refill()
+    clock[0] += 5.0
+    assert tokens_pool.pop() == 2
+    assert not tokens_pool._tokens
+
+    tokens_pool._refill()
+    clock[0] += 4.9
+    assert tokens_pool.pop() == 4
+
+
+def test_started_pool_refills_in_background():
+    tokens_pool = pool(granularity=0.01, size=4)
+    tokens_pool.start()
+    try:
+        first = tokens_pool.pop()
+        for _ in range(500):
+            if len(tokens_pool._tokens) == 4:
+                break
+            tokens_pool._stopped.wait(0.01)
+        assert len(tokens_pool._tokens) == 4
+        assert tokens_pool.pop() != first
+    finally:
+        tokens_pool.stop()